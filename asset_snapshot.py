@@ -0,0 +1,108 @@
+"""Кэш последнего снимка активов с TTL и объединением параллельных запросов."""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Маркер ответа "данные не изменились" (304 или тот же хэш тела ответа)
+NOT_MODIFIED = object()
+
+
+class AssetSnapshotService:
+    """
+    Хранит последний успешно полученный список активов.
+
+    Параллельные вызовы во время обновления ждут один общий запрос к API
+    (single-flight), а обработчики в пределах TTL читают данные из памяти.
+    """
+
+    def __init__(self, fetcher: Callable[[], Awaitable[tuple]], ttl: float):
+        """
+        Args:
+            fetcher: Корутина, возвращающая кортеж (data, error_status);
+                data может быть NOT_MODIFIED, если снимок не изменился
+            ttl: Время актуальности снимка в секундах
+        """
+        self._fetcher = fetcher
+        self._ttl = ttl
+        self._data: list | None = None
+        self._fetched_at: float = 0.0
+        self._version = 0
+        self._inflight: asyncio.Task | None = None
+        # Количество ответов API без изменений (304 или тот же хэш)
+        self.not_modified_count = 0
+
+    @property
+    def data(self) -> list | None:
+        """Последний успешный снимок (может быть устаревшим)"""
+        return self._data
+
+    @property
+    def version(self) -> int:
+        """Номер снимка, увеличивается только когда данные API изменились"""
+        return self._version
+
+    def is_fresh(self) -> bool:
+        """Проверка, что снимок есть и не старше TTL"""
+        return (
+            self._data is not None and time.monotonic() - self._fetched_at < self._ttl
+        )
+
+    async def refresh(self) -> tuple:
+        """
+        Принудительное обновление снимка с API.
+        Если обновление уже идет, дожидается его вместо нового запроса.
+
+        Returns:
+            tuple - (data, error_status) как у fetch_assets
+        """
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._do_refresh())
+            self._inflight.add_done_callback(self._clear_inflight)
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(self._inflight)
+
+    async def get(self) -> tuple:
+        """
+        Получение снимка для обработчиков.
+        Свежий снимок отдается из памяти без запроса к API. При ошибке
+        обновления возвращается последний успешный снимок, если он есть.
+
+        Returns:
+            tuple - (data, error_status)
+        """
+        if self.is_fresh():
+            return self._data, None
+
+        data, error_status = await self.refresh()
+        if data is None and self._data is not None:
+            logger.warning("Не удалось обновить снимок активов, используем устаревший")
+            return self._data, error_status
+        return data, error_status
+
+    async def _do_refresh(self) -> tuple:
+        """Один запрос к API с обновлением кэша при успехе"""
+        data, error_status = await self._fetcher()
+        if data is NOT_MODIFIED:
+            if self._data is None:
+                logger.warning("API ответил 'без изменений', но снимка в памяти нет")
+                return None, None
+            # Данные те же: продлеваем актуальность без разбора JSON
+            self._fetched_at = time.monotonic()
+            self.not_modified_count += 1
+            logger.debug(f"Снимок активов не изменился (версия {self._version})")
+            return self._data, None
+        if data is not None:
+            self._data = data
+            self._fetched_at = time.monotonic()
+            self._version += 1
+            logger.debug(f"Снимок активов обновлен (версия {self._version})")
+        return data, error_status
+
+    def _clear_inflight(self, task: asyncio.Task):
+        """Сброс ссылки на завершенный запрос"""
+        if self._inflight is task:
+            self._inflight = None
@@ -1,36 +1,65 @@
 import asyncio
+import hashlib
 import json
 import logging
 import os
 import tempfile
+import time
 
-import aiohttp
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import FSInputFile, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from asset_snapshot import NOT_MODIFIED, AssetSnapshotService
+from broadcast import active_broadcasts, resume_pending_broadcasts
 from broadcast_router import broadcast_router
+from coalescing import coalesce_notifications
 from config import (
     ADMIN_ID,
     API_URL,
+    ASSETS_CACHE_TTL,
     BOT_TOKEN,
-    DATA_FILE,
     LOG_FILE,
     PROXY,
+    STATS_RECONCILE_INTERVAL,
+    SUBSCRIPTION_INDEX_VERIFY_INTERVAL,
     TEST_API,
     TEST_API_FILE,
+    USER_CACHE_FLUSH_INTERVAL,
 )
 from database import (
-    export_table_to_csv,
-    get_all_users,
+    close_db,
+    connect_db,
     get_bot_statistics,
-    get_subscribed_users,
-    get_user_subscriptions,
+    get_digest_interval,
+    get_digest_user_ids,
+    get_subscribers_by_tickers,
     init_db,
-    save_user,
-    toggle_subscription,
+    iter_user_ids,
+    reconcile_statistics,
+    set_digest_interval,
 )
+from delivery import PRIORITY_ANNOUNCE, PRIORITY_REALTIME, delivery_engine
+from digest import (
+    DIGEST_INTERVALS,
+    digest_worker,
+    interval_label,
+    split_digest,
+)
+from digest import add_events as add_digest_events
+from diff_engine import AUDIENCE_ALL, AUDIENCE_SUBSCRIBERS, diff_assets
+from forecast import forecaster
+from http_client import close_session, get_session
+from outbox import enqueue as enqueue_outbox
+from outbox import OUTBOX_PRIORITIES, outbox_worker, wake_outbox
+from snapshot_store import snapshot_store
+from stats_view import PAGE_CALLBACK_PREFIX, stats_view
+from subscription_index import subscription_index
+from table_export import export_table
+from timeseries import render_history, timeseries
+from user_profiles import user_profiles
 
 # Настройка логирования
 logging.basicConfig(
@@ -53,6 +82,15 @@ dp = Dispatcher()
 dp.include_router(broadcast_router)
 
 
+# Валидаторы последнего успешного ответа API для условных запросов
+_api_validators = {"etag": None, "last_modified": None, "body_hash": None}
+
+# Статистика фоновых проверок: всего и пропущенных без изменений
+poll_stats = {"checks": 0, "skipped": 0}
+# Версия снимка, для которой уже выполнено сравнение с сохраненными данными
+_last_checked_version = 0
+
+
 async def load_test_api_file():
     """Загрузка данных из test_api.json для тестового режима"""
     try:
@@ -80,7 +118,8 @@ async def load_test_api_file():
 
 async def fetch_assets():
     """Получение данных об активах с API или из файла (в тестовом режиме)
-    Возвращает кортеж (data, error_status) где error_status - код ошибки или None при успехе"""
+    Возвращает кортеж (data, error_status) где error_status - код ошибки или None при успехе.
+    Если данные не изменились с прошлого ответа, data равно NOT_MODIFIED"""
     # Если включен тестовый режим, загружаем данные из test_api.json
     if TEST_API:
         logger.info(f"Тестовый режим: загрузка данных из файла {TEST_API_FILE}")
@@ -118,69 +157,60 @@ async def fetch_assets():
             "Cookie": "_cfuvid=h1FR47cJVQMJ8IrzV1DPxR7oembK8XjJGRm7mXjdKis-1767440849890-0.0.1.1-604800000",
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                API_URL, proxy=proxy_url, headers=headers
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    # Проверка типа данных
-                    if not isinstance(data, list):
-                        logger.error(f"API вернул не список, а {type(data)}")
-                        return None, None
-                    logger.info(
-                        f"Данные успешно получены с API. Найдено активов: {len(data)}"
-                    )
-                    return data, None
-                else:
-                    logger.warning(
-                        f"Ошибка при получении данных с API. Статус: {response.status}"
-                    )
-                    return None, response.status
+        # Условный запрос: если API отдает валидаторы, просим только изменения
+        if _api_validators["etag"]:
+            headers["If-None-Match"] = _api_validators["etag"]
+        if _api_validators["last_modified"]:
+            headers["If-Modified-Since"] = _api_validators["last_modified"]
+
+        # Общая сессия с пулом keep-alive соединений (см. http_client)
+        session = await get_session()
+        async with session.get(API_URL, proxy=proxy_url, headers=headers) as response:
+            if response.status == 304:
+                logger.info("Данные API не изменились (304 Not Modified)")
+                return NOT_MODIFIED, None
+            if response.status == 200:
+                body = await response.read()
+
+                # Если валидаторов нет, сравниваем хэш тела ответа без разбора JSON
+                body_hash = hashlib.blake2b(body, digest_size=16).hexdigest()
+                if body_hash == _api_validators["body_hash"]:
+                    logger.info("Данные API не изменились (совпадает хэш ответа)")
+                    return NOT_MODIFIED, None
+
+                data = json.loads(body)
+                # Проверка типа данных
+                if not isinstance(data, list):
+                    logger.error(f"API вернул не список, а {type(data)}")
+                    return None, None
+
+                _api_validators["etag"] = response.headers.get("ETag")
+                _api_validators["last_modified"] = response.headers.get("Last-Modified")
+                _api_validators["body_hash"] = body_hash
+                logger.info(
+                    f"Данные успешно получены с API. Найдено активов: {len(data)}"
+                )
+                return data, None
+            else:
+                logger.warning(
+                    f"Ошибка при получении данных с API. Статус: {response.status}"
+                )
+                return None, response.status
     except Exception as e:
         logger.error(f"Исключение при запросе к API: {e}", exc_info=True)
         return None, None
 
 
-async def save_assets_to_json(data):
-    """Сохранение данных в JSON файл"""
-    try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.debug(f"Данные сохранены в {DATA_FILE}")
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении данных в JSON: {e}", exc_info=True)
+# Общий снимок активов: фоновая задача обновляет его, обработчики читают из памяти
+asset_snapshot = AssetSnapshotService(fetch_assets, ttl=ASSETS_CACHE_TTL)
 
 
-async def load_assets_from_json():
-    """Загрузка сохраненных данных из JSON файла"""
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            # Проверка типа данных
-            if not isinstance(data, list):
-                logger.error(
-                    f"В файле {DATA_FILE} данные не являются списком, а {type(data)}"
-                )
-                return None
-            logger.debug(
-                f"Данные загружены из {DATA_FILE}. Найдено активов: {len(data)}"
-            )
-            return data
-    except FileNotFoundError:
-        logger.debug(f"Файл {DATA_FILE} не найден. Это нормально при первом запуске.")
-        return None
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка при чтении JSON файла: {e}", exc_info=True)
-        return None
-
-
-async def create_assets_keyboard(assets, user_id: int):
+def create_assets_keyboard(assets, user_id: int):
     """Создание инлайн клавиатуры с активами, у которых есть ключ epoch"""
     builder = InlineKeyboardBuilder()
 
-    # Получаем подписки пользователя
-    subscriptions = await get_user_subscriptions(user_id)
+    # Получаем подписки пользователя из индекса в памяти
+    subscriptions = subscription_index.user_tickers(user_id)
 
     for asset in assets:
         if "epoch" in asset and "asset_name" in asset:
@@ -212,17 +242,23 @@ async def cmd_start(message: types.Message):
 
     logger.info(f"Команда /start от пользователя {user.id} (@{user.username})")
 
-    # Сохранение пользователя в базу данных
-    await save_user(
+    # Сохранение пользователя (в БД пишутся только изменения, пачками).
+    # Возвращение неактивного пользователя пишется сразу, иначе сверка
+    # индекса до отложенной записи снова исключила бы его из рассылок
+    reactivated = subscription_index.is_inactive(user.id)
+    await user_profiles.save(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
         last_name=user.last_name,
+        write_through=reactivated,
     )
+    # Пользователь вернулся: снова получает уведомления
+    subscription_index.mark_active(user.id)
     logger.debug(f"Пользователь {user.id} сохранен в базу данных")
 
-    # Получение данных с API
-    assets_data, _ = await fetch_assets()
+    # Получение данных из общего снимка (без запроса к API, если он свежий)
+    assets_data, _ = await asset_snapshot.get()
 
     if assets_data is None:
         logger.warning(f"Не удалось получить данные с API для пользователя {user.id}")
@@ -232,9 +268,6 @@ async def cmd_start(message: types.Message):
         )
         return
 
-    # Сохранение данных в JSON
-    await save_assets_to_json(assets_data)
-
     # Фильтрация активов с ключом epoch
     assets_with_epoch = [asset for asset in assets_data if "epoch" in asset]
     logger.info(f"Найдено активов с epoch: {len(assets_with_epoch)}")
@@ -244,7 +277,7 @@ async def cmd_start(message: types.Message):
         return
 
     # Создание клавиатуры
-    keyboard = await create_assets_keyboard(assets_with_epoch, user.id)
+    keyboard = create_assets_keyboard(assets_with_epoch, user.id)
 
     # Отправка сообщения с кнопками
     text = f"""📊 <b>Select assets to receive notifications</b>
@@ -327,6 +360,63 @@ async def cmd_demo(message: types.Message):
     logger.info(f"Демонстрационные уведомления отправлены пользователю {user.id}")
 
 
+@dp.message(Command("digest"))
+async def cmd_digest(message: types.Message):
+    """Обработчик команды /digest - уведомления сразу или сводкой по расписанию"""
+    user = message.from_user
+    if not user:
+        return
+
+    logger.info(f"Команда /digest от пользователя {user.id} (@{user.username})")
+
+    options = ", ".join(f"<code>/digest {label}</code>" for label in DIGEST_INTERVALS)
+    parts = (message.text or "").split(maxsplit=1)
+    argument = parts[1].strip().lower() if len(parts) > 1 else ""
+
+    try:
+        if not argument:
+            # Показываем текущий режим
+            interval = await get_digest_interval(user.id)
+            if interval:
+                current = f"digest every {interval_label(interval)}"
+            else:
+                current = "instant notifications"
+            await message.answer(
+                f"🗞 <b>Digest mode</b>\n\nCurrent mode: {current}\n\n"
+                f"Receive one summary instead of separate notifications: {options}\n"
+                f"Back to instant notifications: <code>/digest off</code>",
+                parse_mode="HTML",
+            )
+            return
+
+        if argument == "off":
+            await set_digest_interval(user.id, 0)
+            logger.info(f"Пользователь {user.id} отключил режим дайджеста")
+            await message.answer(
+                "🔔 Instant notifications enabled. Pending digest updates will be sent shortly.",
+                parse_mode="HTML",
+            )
+            return
+
+        interval = DIGEST_INTERVALS.get(argument)
+        if interval is None:
+            await message.answer(
+                f"❌ Unknown interval. Available: {options}, <code>/digest off</code>",
+                parse_mode="HTML",
+            )
+            return
+
+        await set_digest_interval(user.id, interval)
+        logger.info(f"Пользователь {user.id} включил дайджест раз в {argument}")
+        await message.answer(
+            f"🗞 Digest enabled: updates will be sent once every {argument}.",
+            parse_mode="HTML",
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /digest: {e}", exc_info=True)
+        await message.answer(f"❌ Error: {e}", parse_mode="HTML")
+
+
 @dp.message(Command("get_data"))
 async def cmd_get_data(message: types.Message):
     """Обработчик команды /get_data для админа"""
@@ -348,13 +438,11 @@ async def cmd_get_data(message: types.Message):
         with tempfile.TemporaryDirectory() as temp_dir:
             csv_files = []
 
-            # Экспортируем таблицы в CSV
+            # Экспортируем таблицы в сжатые CSV (большие - несколькими частями)
             tables = ["users", "user_subscriptions"]
             for table in tables:
-                csv_path = os.path.join(temp_dir, f"{table}.csv")
                 try:
-                    await export_table_to_csv(table, csv_path)
-                    csv_files.append((csv_path, f"{table}.csv"))
+                    csv_files.extend(await export_table(table, temp_dir))
                 except Exception as e:
                     logger.error(
                         f"Ошибка при экспорте таблицы {table}: {e}", exc_info=True
@@ -365,19 +453,41 @@ async def cmd_get_data(message: types.Message):
 
             # Получаем статистику
             stats = await get_bot_statistics()
+            delivery_stats = delivery_engine.metrics()
 
             # Формируем сообщение со статистикой
             stats_text = f"""📊 <b>Bot Statistics</b>
 
 👥 <b>Users:</b>
 • Total users: {stats["total_users"]}
+• Inactive (blocked the bot): {stats["inactive_users"]}
+• Digest mode: {stats["digest_users"]}
 • Users with subscriptions: {stats["users_with_subscriptions"]}
 
 📋 <b>Subscriptions:</b>
 • Total subscriptions: {stats["total_subscriptions"]}
 • Unique assets: {stats["unique_assets"]}
 
-🏆 <b>Top 5 Assets:</b>"""
+🔁 <b>API polling:</b>
+• Checks: {poll_stats["checks"]}
+• Skipped (unchanged): {poll_stats["skipped"]}
+
+📨 <b>Delivery:</b>
+• Sent: {delivery_stats["sent"]}
+• Failed: {delivery_stats["failed"]} (gave up after retries: {delivery_stats["gave_up"]})
+• Retries: {delivery_stats["retried"]} (RetryAfter: {delivery_stats["retry_after"]})
+• Retry delay: total {delivery_stats["retry_delay_total"]:.1f}s, max {delivery_stats["retry_delay_max"]:.1f}s
+• Current rate limit: {delivery_stats["global_rate"]} msg/s
+• Queued: {delivery_stats["queue_size"]}, delayed: {delivery_stats["delayed"]}"""
+
+            # Очереди по классам приоритета: глубина и время ожидания
+            for name, class_stats in delivery_stats["classes"].items():
+                stats_text += (
+                    f"\n• {name}: depth {class_stats['depth']}, "
+                    f"wait avg {class_stats['wait_avg']:.2f}s / max {class_stats['wait_max']:.2f}s"
+                )
+
+            stats_text += "\n\n🏆 <b>Top 5 Assets:</b>"
 
             if stats["top_assets"]:
                 for i, (ticker, name, count) in enumerate(stats["top_assets"], 1):
@@ -498,6 +608,11 @@ It will give you a 5% oink boost 🫶"""
         )
 
 
+def _stats_view_key() -> tuple:
+    """Ключ кэша /get_stats: меняется вместе со снимком активов и прогнозом"""
+    return asset_snapshot.version, forecaster.revision
+
+
 @dp.message(Command("get_stats"))
 async def cmd_get_stats(message: types.Message):
     """Обработчик команды /get_stats - статистика по всем ассетам с эпохой"""
@@ -508,8 +623,11 @@ async def cmd_get_stats(message: types.Message):
     logger.info(f"Команда /get_stats от пользователя {user.id} (@{user.username})")
 
     try:
-        # Получение данных с API
-        assets_data, _ = await fetch_assets()
+        # Снимок обновляет фоновая проверка; к API обращаемся, только если
+        # снимка еще нет (сразу после запуска)
+        assets_data = asset_snapshot.data
+        if assets_data is None:
+            assets_data, _ = await asset_snapshot.get()
 
         if assets_data is None:
             logger.warning(
@@ -521,60 +639,80 @@ async def cmd_get_stats(message: types.Message):
             )
             return
 
-        # Фильтрация активов с ключом epoch
-        assets_with_epoch = [asset for asset in assets_data if "epoch" in asset]
-        logger.info(f"Найдено активов с epoch: {len(assets_with_epoch)}")
-
-        if not assets_with_epoch:
+        # Готовая первая страница (рендер - только после изменения снимка)
+        page = stats_view.page(assets_data, _stats_view_key())
+        if page is None:
             await message.answer("ℹ️ No assets found.", parse_mode="HTML")
             return
 
-        # Формирование сообщения со статистикой
-        stats_lines = ["📊 <b>Assets Statistics</b>\n"]
+        text, keyboard = page
+        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+        logger.info(f"Статистика отправлена пользователю {user.id}")
 
-        for asset in assets_with_epoch:
-            asset_name = asset.get("asset_name", "Unknown")
-            ticker = asset.get("asset_ticker", "N/A")
-            epoch = asset.get("epoch", "N/A")
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /get_stats: {e}", exc_info=True)
+        await message.answer(f"❌ Error: {e}", parse_mode="HTML")
 
-            # Получаем значения lst_tvl и lst_cap
-            lst_tvl = asset.get("lst_tvl")
-            lst_cap = asset.get("lst_cap")
 
-            # Формируем строку с информацией о заполнении
-            if lst_tvl is not None and lst_cap is not None:
-                try:
-                    tvl_int = int(float(lst_tvl))
-                    cap_int = int(float(lst_cap))
-
-                    # Вычисляем процент заполнения
-                    if cap_int > 0:
-                        percentage = (tvl_int / cap_int) * 100
-                        percentage_str = f"{percentage:.2f}%"
-                    else:
-                        percentage_str = "N/A"
-
-                    fill_info = f"{tvl_int:,} / {cap_int:,} ({percentage_str})"
-                except (ValueError, TypeError):
-                    fill_info = "N/A"
-            else:
-                fill_info = "N/A"
+@dp.callback_query(lambda c: c.data.startswith(PAGE_CALLBACK_PREFIX))
+async def process_stats_page(callback: types.CallbackQuery):
+    """Обработчик листания страниц /get_stats"""
+    try:
+        number = int(callback.data[len(PAGE_CALLBACK_PREFIX) :])
+    except ValueError:
+        await callback.answer()
+        return
 
-            # Добавляем информацию об активе
-            stats_lines.append(f"<b>{asset_name}</b> ({ticker})")
-            stats_lines.append(f"Epoch: {epoch}")
-            stats_lines.append(f"Filled: {fill_info}")
-            stats_lines.append("")  # Пустая строка для разделения
+    assets_data = asset_snapshot.data
+    page = None
+    if assets_data is not None:
+        page = stats_view.page(assets_data, _stats_view_key(), number)
+    if page is None:
+        await callback.answer("❌ Error loading data", show_alert=True)
+        return
 
-        # Объединяем все строки в одно сообщение
-        stats_message = "\n".join(stats_lines)
+    text, keyboard = page
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    except TelegramBadRequest as e:
+        # Та же страница без изменений - не ошибка
+        if "message is not modified" not in str(e):
+            logger.warning(f"Не удалось показать страницу статистики: {e}")
+    await callback.answer()
 
-        # Отправляем сообщение
-        await message.answer(stats_message, parse_mode="HTML")
-        logger.info(f"Статистика отправлена пользователю {user.id}")
 
+@dp.message(Command("history"))
+async def cmd_history(message: types.Message):
+    """Обработчик команды /history <ticker> - динамика заполнения актива"""
+    user = message.from_user
+    if not user:
+        return
+
+    logger.info(f"Команда /history от пользователя {user.id} (@{user.username})")
+
+    parts = (message.text or "").split(maxsplit=1)
+    ticker = parts[1].strip() if len(parts) > 1 else ""
+
+    try:
+        if not ticker:
+            await message.answer(
+                "📈 Usage: <code>/history TICKER</code>\n\n"
+                "Shows how the asset capacity changed per minute, hour and day.",
+                parse_mode="HTML",
+            )
+            return
+
+        series = timeseries.get(ticker)
+        if series is None:
+            await message.answer(
+                "ℹ️ No history for this asset yet. Check the ticker in /get_stats.",
+                parse_mode="HTML",
+            )
+            return
+
+        await message.answer(render_history(series), parse_mode="HTML")
     except Exception as e:
-        logger.error(f"Ошибка при выполнении команды /get_stats: {e}", exc_info=True)
+        logger.error(f"Ошибка при выполнении команды /history: {e}", exc_info=True)
         await message.answer(f"❌ Error: {e}", parse_mode="HTML")
 
 
@@ -586,7 +724,7 @@ async def process_asset_toggle(callback: types.CallbackQuery):
     logger.info(f"Переключение подписки на {asset_ticker} для пользователя {user.id}")
 
     # Загружаем данные об активах для получения названия
-    assets_data, _ = await fetch_assets()
+    assets_data, _ = await asset_snapshot.get()
     if assets_data is None:
         logger.warning(
             f"Не удалось загрузить данные для переключения подписки пользователя {user.id}"
@@ -606,7 +744,7 @@ async def process_asset_toggle(callback: types.CallbackQuery):
     asset_name = asset.get("asset_name", asset_ticker)
 
     # Переключаем подписку
-    is_subscribed = await toggle_subscription(user.id, asset_ticker, asset_name)
+    is_subscribed = await subscription_index.toggle(user.id, asset_ticker, asset_name)
 
     if is_subscribed:
         logger.info(
@@ -621,7 +759,7 @@ async def process_asset_toggle(callback: types.CallbackQuery):
 
     # Обновляем клавиатуру
     assets_with_epoch = [a for a in assets_data if "epoch" in a]
-    new_keyboard = await create_assets_keyboard(assets_with_epoch, user.id)
+    new_keyboard = create_assets_keyboard(assets_with_epoch, user.id)
 
     # Обновляем сообщение
     try:
@@ -641,261 +779,151 @@ Click on an asset to enable/disable notifications"""
         )
 
 
+async def queue_notifications(
+    notifications: list[dict], announcements: list[dict]
+) -> int:
+    """
+    Постановка событий цикла в очередь уведомлений или в дайджест.
+
+    Args:
+        notifications: События подписчиков со списками получателей (users)
+        announcements: События для всех активных пользователей; получатели
+            читаются из БД пачками, память не зависит от числа пользователей
+
+    Returns:
+        int - количество добавленных в очередь сообщений
+    """
+    if not notifications and not announcements:
+        return 0
+
+    digest_users = await get_digest_user_ids()
+
+    async def queue_part(part: list[dict]) -> int:
+        # Пользователи в режиме дайджеста получат события позже одним сообщением
+        realtime, digest_rows = split_digest(part, digest_users)
+        # Все события пользователя за цикл - одним сообщением
+        queued = await enqueue_outbox(coalesce_notifications(realtime))
+        await add_digest_events(digest_rows)
+        return queued
+
+    if not announcements:
+        return await queue_part(notifications)
+
+    # События подписчиков по пользователям: объединяются с анонсами в его пачке
+    pending = {}
+    for index, notification in enumerate(notifications):
+        for user_id in notification["users"]:
+            pending.setdefault(user_id, []).append(index)
+
+    def build_part(batch) -> list[dict]:
+        by_notification = {}
+        for user_id in batch:
+            for index in pending.pop(user_id, ()):
+                by_notification.setdefault(index, []).append(user_id)
+        return [
+            {**notifications[index], "users": users}
+            for index, users in sorted(by_notification.items())
+        ]
+
+    queued = 0
+    async for batch in iter_user_ids():
+        part = [{**announcement, "users": batch} for announcement in announcements]
+        queued += await queue_part(part + build_part(batch))
+
+    # Подписчики, не попавшие в обход (например, зарегистрировались во время него)
+    if pending:
+        queued += await queue_part(build_part(list(pending)))
+
+    return queued
+
+
 async def check_assets_changes():
     """Проверка изменений в активах и сбор списка уведомлений
     Возвращает кортеж (notifications, error_status) где error_status - код ошибки или None"""
     logger.info("Начало проверки изменений в активах")
 
-    # Получаем текущие данные с API
-    current_assets, error_status = await fetch_assets()
+    global _last_checked_version
+
+    # Получаем текущие данные с API и обновляем общий снимок
+    current_assets, error_status = await asset_snapshot.refresh()
     if current_assets is None:
         logger.warning("Не удалось получить данные с API для проверки изменений")
         return [], error_status
 
+    poll_stats["checks"] += 1
+    # Ряды TVL и прогноз заполнения пополняются на каждом опросе,
+    # в том числе без изменений
+    now = time.time()
+    timeseries.add_snapshot(current_assets, now)
+    forecaster.add_snapshot(current_assets, now)
+
+    # Снимок не изменился с прошлой проверки: пропускаем сравнение и сохранение
+    snapshot_version = asset_snapshot.version
+    if snapshot_version == _last_checked_version:
+        poll_stats["skipped"] += 1
+        logger.debug(
+            f"Снимок активов не изменился. Пропущено проверок: {poll_stats['skipped']} из {poll_stats['checks']}"
+        )
+        return [], None
+
     # Загружаем сохраненные данные
-    saved_assets = await load_assets_from_json()
+    saved_assets = await snapshot_store.load()
     if saved_assets is None:
         # Если нет сохраненных данных, просто сохраняем текущие
         logger.info("Сохраненных данных нет. Сохраняем текущие данные.")
-        await save_assets_to_json(current_assets)
-        return []
+        await snapshot_store.save(current_assets)
+        _last_checked_version = snapshot_version
+        return [], None
+
+    # Один проход по изменившимся активам через зарегистрированные правила
+    events = diff_assets(saved_assets, current_assets, fill_note=forecaster.fill_note)
+
+    # Подписчики всех изменившихся активов: из индекса в памяти,
+    # а если он не загружен - одним запросом к БД
+    changed_tickers = [
+        event["asset_ticker"]
+        for event in events
+        if event["audience"] == AUDIENCE_SUBSCRIBERS
+    ]
+    if subscription_index.loaded:
+        subscribers = subscription_index.subscribers_by_tickers(changed_tickers)
+    else:
+        subscribers = await get_subscribers_by_tickers(changed_tickers)
 
     notifications = []
-
-    # Создаем словари для быстрого поиска по тикеру
-    # Фильтруем активы с валидным тикером (не None и не пустая строка)
-    saved_dict = {
-        asset.get("asset_ticker"): asset
-        for asset in saved_assets
-        if asset.get("asset_ticker") and isinstance(asset.get("asset_ticker"), str)
-    }
-    current_dict = {
-        asset.get("asset_ticker"): asset
-        for asset in current_assets
-        if asset.get("asset_ticker") and isinstance(asset.get("asset_ticker"), str)
-    }
-
-    logger.debug(
-        f"Сравнение: сохранено {len(saved_dict)} активов, текущих {len(current_dict)} активов"
-    )
-
-    # Получаем список всех пользователей один раз для оптимизации
-    all_users = await get_all_users()
-
-    # 1. Проверяем появление ключа epoch (для существующих и новых объектов)
-    for ticker, current_asset in current_dict.items():
-        saved_asset = saved_dict.get(ticker)
-        current_has_epoch = "epoch" in current_asset
-        saved_has_epoch = (
-            saved_asset and "epoch" in saved_asset if saved_asset else False
-        )
-
-        if current_has_epoch and not saved_has_epoch:
-            # Появился ключ epoch (новый актив или у существующего)
-            asset_name = current_asset.get("asset_name", ticker)
+    # Анонсы для всех пользователей: список получателей не загружается целиком,
+    # а читается из БД потоком при постановке в очередь
+    announcements = []
+    for event in events:
+        ticker = event["asset_ticker"]
+        if event.pop("audience") == AUDIENCE_ALL:
+            event["priority"] = PRIORITY_ANNOUNCE
+            announcements.append(event)
             logger.info(
-                f"Обнаружено появление epoch для актива {asset_name} ({ticker}). Пользователей для уведомления: {len(all_users)}"
-            )
-
-            # Формируем информацию "сколько осталось из скольки"
-            capacity_info = ""
-            current_lst_cap = current_asset.get("lst_cap")
-            current_lst_tvl = current_asset.get("lst_tvl")
-            if current_lst_cap is not None and current_lst_tvl is not None:
-                try:
-                    cap_int = int(float(current_lst_cap))
-                    tvl_int = int(float(current_lst_tvl))
-                    capacity_info = f"\nFilled: {tvl_int:,} / {cap_int:,}"
-                except (ValueError, TypeError):
-                    pass
-
-            notifications.append(
-                {
-                    "type": "epoch_appeared",
-                    "asset_ticker": ticker,
-                    "asset_name": asset_name,
-                    "users": all_users,
-                    "message": f'🆕 New asset added <b>{asset_name}</b>!{capacity_info}\n\nUse /start to configure notifications for this asset.\n\n<a href="https://app.piggybank.fi/">Open PiggyBank</a>',
-                }
+                f"Уведомление '{event['type']}' для {event['asset_name']} ({ticker}) добавлено в очередь. Получатели: все пользователи"
             )
+            continue
+
+        users = subscribers.get(ticker)
+        if not users:
+            continue
+        event["priority"] = PRIORITY_REALTIME
+        event["users"] = users
+        notifications.append(event)
+        logger.info(
+            f"Уведомление '{event['type']}' для {event['asset_name']} ({ticker}) добавлено в очередь. Получателей: {len(users)}"
+        )
 
-    # 2. Проверяем изменение ключа epoch
-    for ticker, current_asset in current_dict.items():
-        saved_asset = saved_dict.get(ticker)
-        if saved_asset and "epoch" in current_asset and "epoch" in saved_asset:
-            current_epoch = current_asset.get("epoch")
-            saved_epoch = saved_asset.get("epoch")
-
-            if current_epoch != saved_epoch:
-                asset_name = current_asset.get("asset_name", ticker)
-                subscribed_users = await get_subscribed_users(ticker)
-                if subscribed_users:
-                    logger.info(
-                        f"Обнаружено изменение epoch для {asset_name} ({ticker}): {saved_epoch} → {current_epoch}. Подписчиков: {len(subscribed_users)}"
-                    )
-
-                    # Формируем информацию "сколько осталось из скольки"
-                    capacity_info = ""
-                    current_lst_cap = current_asset.get("lst_cap")
-                    current_lst_tvl = current_asset.get("lst_tvl")
-                    if current_lst_cap is not None and current_lst_tvl is not None:
-                        try:
-                            cap_int = int(float(current_lst_cap))
-                            tvl_int = int(float(current_lst_tvl))
-                            capacity_info = f"\nFilled: {tvl_int:,} / {cap_int:,}"
-                        except (ValueError, TypeError):
-                            pass
-
-                    notifications.append(
-                        {
-                            "type": "epoch_changed",
-                            "asset_ticker": ticker,
-                            "asset_name": asset_name,
-                            "users": subscribed_users,
-                            "old_epoch": saved_epoch,
-                            "new_epoch": current_epoch,
-                            "message": f'🆕✨🔄 <b>NEW EPOCH!</b> ✨🆕\n\n<b>{asset_name}</b>\nEpoch: {saved_epoch} → {current_epoch}{capacity_info}\n\n<a href="https://app.piggybank.fi/">Open PiggyBank</a>',
-                        }
-                    )
+    # Сначала сохраняем уведомления в очередь, затем новый снимок:
+    # при сбое между шагами изменения будут найдены повторно, а не потеряны
+    queued = await queue_notifications(notifications, announcements)
+    if queued:
+        logger.info(f"В очередь добавлено уведомлений: {queued}")
+    notifications = announcements + notifications
 
-    # 3. Проверяем изменения lst_tvl (только для существующих активов, не отслеживаем появление)
-    for ticker, current_asset in current_dict.items():
-        saved_asset = saved_dict.get(ticker)
-        if saved_asset:
-            current_lst_tvl = current_asset.get("lst_tvl")
-            saved_lst_tvl = saved_asset.get("lst_tvl")
-            current_lst_cap = current_asset.get("lst_cap")
-
-            # Проверяем, что значения существуют (не отслеживаем появление lst_tvl, только изменения)
-            if current_lst_tvl is not None and saved_lst_tvl is not None:
-                try:
-                    # Преобразование в float для сохранения десятичной части
-                    current_tvl_float = float(current_lst_tvl)
-                    saved_tvl_float = float(saved_lst_tvl)
-
-                    # Вычисляем изменение
-                    change = current_tvl_float - saved_tvl_float
-                    change_abs = abs(change)
-
-                    # Проверяем изменение больше чем на 1 целое
-                    if change_abs > 1.0:
-                        asset_name = current_asset.get("asset_name", ticker)
-                        change_sign = "+" if change > 0 else ""
-                        logger.info(
-                            f"Изменение lst_tvl для {asset_name} ({ticker}): {saved_tvl_float} → {current_tvl_float} ({change_sign}{change})"
-                        )
-
-                        # Отправляем уведомление подписанным пользователям
-                        subscribed_users = await get_subscribed_users(ticker)
-                        if subscribed_users:
-                            # Формируем изменение с точностью до сотых и знаком + или -
-                            change_text = f"{change:+.2f}" if change != 0 else "0.00"
-
-                            # Формируем информацию "сколько осталось из скольки"
-                            capacity_info = ""
-                            if current_lst_cap is not None:
-                                try:
-                                    cap_int = int(float(current_lst_cap))
-                                    tvl_int = int(current_tvl_float)
-                                    capacity_info = (
-                                        f"\nFilled: {tvl_int:,} / {cap_int:,}"
-                                    )
-                                except (ValueError, TypeError):
-                                    pass
-
-                            # Выбираем эмодзи в зависимости от направления изменения
-                            change_emoji = "📈" if change > 0 else "📉"
-                            user_message = f'{change_emoji} <b>Capacity changed</b>\n\nAsset: <b>{asset_name}</b> ({ticker})\nChange: {change_text}{capacity_info}\n\n<a href="https://app.piggybank.fi/">Open PiggyBank</a>'
-                            notifications.append(
-                                {
-                                    "type": "lst_tvl_changed",
-                                    "asset_ticker": ticker,
-                                    "asset_name": asset_name,
-                                    "users": subscribed_users,
-                                    "old_value": saved_tvl_float,
-                                    "new_value": current_tvl_float,
-                                    "change": change,
-                                    "message": user_message,
-                                }
-                            )
-                            logger.info(
-                                f"Уведомление об изменении lst_tvl для {asset_name} ({ticker}) добавлено в очередь. Подписчиков: {len(subscribed_users)}"
-                            )
-                except (ValueError, TypeError) as e:
-                    logger.warning(
-                        f"Ошибка при преобразовании значений lst_tvl для {ticker}: {e}"
-                    )
-                    continue
-
-    # 4. Проверяем изменения lst_cap (только для существующих активов)
-    for ticker, current_asset in current_dict.items():
-        saved_asset = saved_dict.get(ticker)
-        if saved_asset:
-            current_lst_cap = current_asset.get("lst_cap")
-            saved_lst_cap = saved_asset.get("lst_cap")
-            current_lst_tvl = current_asset.get("lst_tvl")
-
-            # Проверяем, что значения существуют
-            if current_lst_cap is not None and saved_lst_cap is not None:
-                try:
-                    # Преобразование в float для сохранения десятичной части
-                    current_cap_float = float(current_lst_cap)
-                    saved_cap_float = float(saved_lst_cap)
-
-                    # Вычисляем изменение
-                    change = current_cap_float - saved_cap_float
-                    change_abs = abs(change)
-
-                    # Отправляем уведомление при любом изменении (не только > 1)
-                    if change_abs > 0:
-                        asset_name = current_asset.get("asset_name", ticker)
-                        change_sign = "+" if change > 0 else ""
-                        logger.info(
-                            f"Изменение lst_cap для {asset_name} ({ticker}): {saved_cap_float} → {current_cap_float} ({change_sign}{change})"
-                        )
-
-                        # Отправляем уведомление подписанным пользователям
-                        subscribed_users = await get_subscribed_users(ticker)
-                        if subscribed_users:
-                            # Формируем изменение с точностью до сотых и знаком + или -
-                            change_text = f"{change:+.2f}" if change != 0 else "0.00"
-
-                            # Формируем информацию "сколько осталось из скольки"
-                            capacity_info = ""
-                            if current_lst_tvl is not None:
-                                try:
-                                    cap_int = int(current_cap_float)
-                                    tvl_int = int(float(current_lst_tvl))
-                                    capacity_info = (
-                                        f"\nFilled: {tvl_int:,} / {cap_int:,}"
-                                    )
-                                except (ValueError, TypeError):
-                                    pass
-
-                            user_message = f'⚡️🔧⚡️ <b>CAPACITY LIMIT CHANGED</b> ⚡️🔧⚡️\n\n<b>{asset_name}</b> ({ticker})\nChange: {change_text}{capacity_info}\n\n<a href="https://app.piggybank.fi/">Open PiggyBank</a>'
-                            notifications.append(
-                                {
-                                    "type": "lst_cap_changed",
-                                    "asset_ticker": ticker,
-                                    "asset_name": asset_name,
-                                    "users": subscribed_users,
-                                    "old_value": saved_cap_float,
-                                    "new_value": current_cap_float,
-                                    "change": change,
-                                    "message": user_message,
-                                }
-                            )
-                            logger.info(
-                                f"Уведомление об изменении lst_cap для {asset_name} ({ticker}) добавлено в очередь. Подписчиков: {len(subscribed_users)}"
-                            )
-                except (ValueError, TypeError) as e:
-                    logger.warning(
-                        f"Ошибка при преобразовании значений lst_cap для {ticker}: {e}"
-                    )
-                    continue
-
-    # 5. Обновляем сохраненные данные
-    await save_assets_to_json(current_assets)
+    # Обновляем сохраненные данные
+    await snapshot_store.save(current_assets)
+    _last_checked_version = snapshot_version
 
     if notifications:
         logger.info(f"Проверка завершена. Найдено изменений: {len(notifications)}")
@@ -905,47 +933,6 @@ async def check_assets_changes():
     return notifications, None
 
 
-async def send_notifications(notifications):
-    """Рассылка уведомлений пользователям в фоне"""
-    logger.info(f"Начало рассылки уведомлений. Всего уведомлений: {len(notifications)}")
-
-    total_sent = 0
-    total_failed = 0
-
-    for notification in notifications:
-        notification_type = notification.get("type", "unknown")
-        users = notification.get("users", [])
-        message_text = notification.get("message", "")
-        asset_name = notification.get("asset_name", "unknown")
-
-        logger.info(
-            f"Рассылка уведомления типа '{notification_type}' для актива {asset_name}. Получателей: {len(users)}"
-        )
-
-        # Добавляем текст в конец каждого уведомления
-        message_with_footer = f"{message_text}\n\nSay /thankyou 😊"
-
-        for user_id in users:
-            try:
-                await bot.send_message(
-                    user_id,
-                    message_with_footer,
-                    parse_mode="HTML",
-                    link_preview_options=types.LinkPreviewOptions(is_disabled=True),
-                )
-                total_sent += 1
-                # Небольшая задержка, чтобы не перегружать API
-                await asyncio.sleep(0.05)
-            except Exception as e:
-                total_failed += 1
-                # Игнорируем ошибки отправки (пользователь заблокировал бота и т.д.)
-                logger.warning(
-                    f"Не удалось отправить уведомление пользователю {user_id}: {e}"
-                )
-
-    logger.info(f"Рассылка завершена. Отправлено: {total_sent}, Ошибок: {total_failed}")
-
-
 async def notify_admin_about_api_error(error_status, error_message=None):
     """Отправка уведомления админу об ошибке API"""
     if not ADMIN_ID:
@@ -1005,11 +992,10 @@ async def background_task():
                 )
                 wait_interval = 60
 
-            # Рассылаем уведомления в фоне
+            # Уведомления уже в очереди, будим отправителя
             if notifications:
                 logger.info(f"Запуск рассылки {len(notifications)} уведомлений в фоне")
-                # Запускаем рассылку в отдельной задаче
-                asyncio.create_task(send_notifications(notifications))
+                wake_outbox()
 
         except Exception as e:
             logger.error(f"Ошибка в фоновой задаче: {e}", exc_info=True)
@@ -1023,6 +1009,33 @@ async def background_task():
         await asyncio.sleep(wait_interval)
 
 
+async def subscription_index_verify_task():
+    """Периодическая сверка индекса подписок в памяти с БД"""
+    while True:
+        await asyncio.sleep(SUBSCRIPTION_INDEX_VERIFY_INTERVAL)
+        try:
+            await subscription_index.verify()
+        except Exception as e:
+            logger.error(f"Ошибка при сверке индекса подписок: {e}", exc_info=True)
+
+
+async def statistics_reconcile_task():
+    """Периодический пересчет счетчиков статистики с нуля"""
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+        try:
+            await reconcile_statistics()
+        except Exception as e:
+            logger.error(f"Ошибка при пересчете статистики: {e}", exc_info=True)
+
+
+async def stop_tasks(tasks):
+    """Отмена фоновых задач и ожидание их завершения"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
 async def main():
     """Главная функция"""
     logger.info("=" * 50)
@@ -1039,8 +1052,10 @@ async def main():
     # Инициализация базы данных
     logger.info("Инициализация базы данных")
     try:
+        await connect_db()
         await init_db()
         logger.info("База данных инициализирована")
+        await subscription_index.load()
     except Exception as e:
         logger.error(f"Критическая ошибка при инициализации БД: {e}", exc_info=True)
         return
@@ -1057,13 +1072,48 @@ async def main():
     else:
         logger.warning("ADMIN_ID не указан, сообщение админу не отправлено")
 
+    # Запуск воркеров отправки сообщений
+    delivery_engine.start()
+
+    # Продолжение рассылок, прерванных перезапуском
+    try:
+        await resume_pending_broadcasts(bot)
+    except Exception as e:
+        logger.error(f"Не удалось продолжить прерванные рассылки: {e}", exc_info=True)
+
     # Запуск фоновой задачи
     logger.info("Запуск фоновой задачи проверки изменений")
-    asyncio.create_task(background_task())
+    tasks = [
+        asyncio.create_task(background_task()),
+        asyncio.create_task(subscription_index_verify_task()),
+        asyncio.create_task(statistics_reconcile_task()),
+        asyncio.create_task(digest_worker()),
+        asyncio.create_task(user_profiles.run(USER_CACHE_FLUSH_INTERVAL)),
+    ]
+    # Отправители очереди уведомлений (досылают незавершенное после перезапуска)
+    for priority in OUTBOX_PRIORITIES:
+        tasks.append(asyncio.create_task(outbox_worker(bot, priority)))
 
     # Запуск бота
     logger.info("Бот запущен и готов к работе")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Сначала останавливаем фоновые задачи и рассылки: они обращаются к API и БД.
+        # Прерванные рассылки остаются running и продолжатся при запуске
+        await stop_tasks(tasks + list(active_broadcasts.values()))
+        await delivery_engine.stop()
+        # Дописываем отложенные профили пользователей
+        try:
+            await user_profiles.flush()
+        except Exception as e:
+            logger.error(
+                f"Не удалось сохранить профили пользователей: {e}", exc_info=True
+            )
+        # Закрываем общий HTTP клиент, чтобы не оставлять открытые соединения
+        await close_session()
+        # Соединения с БД закрываем последними: отправители пишут результаты
+        await close_db()
 
 
 if __name__ == "__main__":
@@ -3,155 +3,266 @@
 import asyncio
 import logging
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.types import FSInputFile
 
-from config import BROADCAST_LOGS_DIR
-from database import get_all_users
+from config import BROADCAST_BATCH_SIZE, BROADCAST_LOGS_DIR
+from database import (
+    checkpoint_broadcast_job,
+    count_active_users,
+    create_broadcast_job,
+    get_broadcast_jobs,
+    iter_user_ids,
+    set_broadcast_job_status,
+)
+from delivery import PRIORITY_BROADCAST, delivery_engine
+from recipients import DeadRecipients
 
 logger = logging.getLogger(__name__)
 
 # Словарь для хранения активных задач рассылки {admin_id: task}
 active_broadcasts = {}
+# Админы, чья рассылка создается или продолжается, но задача еще не запущена
+_starting = set()
+# Запрошенная остановка активной рассылки {admin_id: "paused" | "cancelled"}
+# Если задача отменена без запроса (остановка бота), задание продолжится при запуске
+_stop_requests = {}
+
+
+def _write_log_header(log, job: dict):
+    """Параметры рассылки в начале лога"""
+    log.write("=" * 60 + "\n")
+    log.write("ПАРАМЕТРЫ РАССЫЛКИ\n")
+    log.write("=" * 60 + "\n")
+    log.write(f"Рассылка ID: {job['id']}\n")
+    log.write(f"Дата и время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    log.write(f"Админ ID: {job['admin_id']}\n")
+    log.write("Тип рассылки: Все пользователи из БД\n")
+    # file_id - это внутренний идентификатор Telegram
+    log.write(f"Картинка (file_id): Photo file_id: {job['photo_file_id']}\n")
+    log.write(f"Текст сообщения:\n{job['caption']}\n")
+    log.write(f"Количество получателей: {job['total_users']}\n")
+    log.write("=" * 60 + "\n\n")
+    log.write("ЛОГ ОТПРАВКИ\n")
+    log.write("=" * 60 + "\n")
+
+
+def _completed_prefix(batch: list[int], results: dict) -> tuple[int | None, int, int]:
+    """
+    Обработанное начало пачки получателей.
 
+    Отправка идет параллельно, поэтому курсор сдвигается только до первого
+    получателя без результата: остальные будут отправлены при продолжении.
 
-async def send_broadcast_task(
-    bot: Bot,
-    photo_file_id: str | None,
-    caption: str,
-    admin_id: int,
-    parse_mode: str = "HTML",
-):
-    """
-    Фоновая задача для отправки рассылки пользователям.
-    Выполняется асинхронно и отправляет результат админу после завершения.
+    Returns:
+        tuple - (последний обработанный user_id или None, успешно, ошибок)
     """
+    last_user_id = None
     successful = 0
     failed = 0
+    for user_id in batch:
+        if user_id not in results:
+            break
+        last_user_id = user_id
+        if results[user_id] is None:
+            successful += 1
+        else:
+            failed += 1
+    return last_user_id, successful, failed
+
+
+def _reserve(admin_id: int) -> bool:
+    """
+    Занять слот рассылки админа до первого await.
+    Повторное нажатие или команда, пришедшие одновременно, получат False.
+    """
+    if admin_id in active_broadcasts or admin_id in _starting:
+        return False
+    _starting.add(admin_id)
+    return True
+
+
+def _unregister(admin_id: int):
+    """Удаление текущей задачи из активных рассылок"""
+    if active_broadcasts.get(admin_id) is asyncio.current_task():
+        del active_broadcasts[admin_id]
+        logger.info(
+            f"Broadcast task removed from active_broadcasts for admin {admin_id}"
+        )
+
+
+async def _send_log_file(bot: Bot, admin_id: int, log_file: Path):
+    """Отправка файла лога рассылки админу"""
+    if log_file.exists():
+        document = FSInputFile(str(log_file))
+        await bot.send_document(
+            chat_id=admin_id, document=document, caption="📄 Лог рассылки"
+        )
+
+
+async def send_broadcast_task(bot: Bot, job: dict):
+    """
+    Фоновая задача для отправки рассылки пользователям.
+
+    Получатели обходятся по возрастанию user_id пачками, после каждой пачки
+    курсор и счетчики сохраняются в задании. Задание можно приостановить,
+    отменить или продолжить после перезапуска с места остановки.
+    """
+    job_id = job["id"]
+    admin_id = job["admin_id"]
+    photo_file_id = job["photo_file_id"]
+    caption = job["caption"]
+    parse_mode = job["parse_mode"]
+    cursor_user_id = job["cursor_user_id"]
+    successful = job["successful"]
+    failed = job["failed"]
+    log_file = Path(job["log_file"])
 
     try:
-        # Получаем всех пользователей из БД
-        user_ids = await get_all_users()
-        # Преобразуем в формат словарей для совместимости
-        users = [{"telegram_id": user_id} for user_id in user_ids]
+        is_new_log = not log_file.exists()
+        with open(log_file, "a", encoding="utf-8") as log:
+            if is_new_log:
+                _write_log_header(log, job)
+            elif cursor_user_id:
+                log.write(
+                    f"\n--- Продолжение после пользователя {cursor_user_id} "
+                    f"({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}) ---\n"
+                )
 
-        total_users = len(users)
+            def send_to_user(user_id: int):
+                """Корутина отправки сообщения рассылки одному пользователю"""
+                if photo_file_id:
+                    return bot.send_photo(
+                        chat_id=user_id,
+                        photo=photo_file_id,
+                        caption=caption,
+                        parse_mode=parse_mode if parse_mode else None,
+                    )
+                return bot.send_message(
+                    chat_id=user_id,
+                    text=caption,
+                    parse_mode=parse_mode if parse_mode else None,
+                )
 
-        # Создаем файл лога для этой рассылки
-        log_file = (
-            Path(BROADCAST_LOGS_DIR)
-            / f"broadcast_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-        )
+            # Получатели читаются потоком пачками, начиная с сохраненного курсора
+            async for batch in iter_user_ids(BROADCAST_BATCH_SIZE, cursor_user_id):
+                # Результат по каждому получателю пачки: None или ошибка
+                results = {}
+                dead_recipients = DeadRecipients()
+
+                def on_result(user_id: int, error: Exception | None):
+                    """Учет результата отправки одному пользователю"""
+                    results[user_id] = error
+                    dead_recipients.record(user_id, error)
+                    if error is None:
+                        log.write(f"User {user_id}: SUCCESS\n")
+                        logger.debug(f"Sent signal to user {user_id}")
+                    elif isinstance(error, TelegramForbiddenError):
+                        # Пользователь заблокировал бота
+                        error_msg = "User blocked the bot"
+                        log.write(f"User {user_id}: FAILED - {error_msg}\n")
+                        logger.warning(f"User {user_id} blocked the bot")
+                    elif isinstance(error, TelegramBadRequest):
+                        # Другая ошибка
+                        log.write(f"User {user_id}: FAILED - {error}\n")
+                        logger.error(f"Failed to send to user {user_id}: {error}")
+                    else:
+                        # Неожиданная ошибка
+                        log.write(f"User {user_id}: FAILED - {error}\n")
+                        logger.error(
+                            f"Unexpected error sending to user {user_id}: {error}"
+                        )
 
-        # Формируем информацию о картинке (file_id - это внутренний идентификатор Telegram)
-        photo_info = f"Photo file_id: {photo_file_id}"
-
-        with open(log_file, "w", encoding="utf-8") as log:
-            # Параметры сообщения в начале лога
-            log.write("=" * 60 + "\n")
-            log.write("ПАРАМЕТРЫ РАССЫЛКИ\n")
-            log.write("=" * 60 + "\n")
-            log.write(f"Дата и время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            log.write(f"Админ ID: {admin_id}\n")
-            log.write("Тип рассылки: Все пользователи из БД\n")
-            log.write(f"Картинка (file_id): {photo_info}\n")
-            log.write(f"Текст сообщения:\n{caption}\n")
-            log.write(f"Количество получателей: {total_users}\n")
-            log.write("=" * 60 + "\n\n")
-            log.write("ЛОГ ОТПРАВКИ\n")
-            log.write("=" * 60 + "\n")
-
-            # Отправляем каждому пользователю
-            for user in users:
-                user_id = user["telegram_id"]
                 try:
-                    if photo_file_id:
-                        await bot.send_photo(
-                            chat_id=user_id,
-                            photo=photo_file_id,
-                            caption=caption,
-                            parse_mode=parse_mode if parse_mode else None,
-                        )
-                    else:
-                        await bot.send_message(
-                            chat_id=user_id,
-                            text=caption,
-                            parse_mode=parse_mode if parse_mode else None,
+                    # Отправляем пачку через общий движок отправки
+                    await delivery_engine.deliver(
+                        (
+                            (user_id, partial(send_to_user, user_id))
+                            for user_id in batch
+                        ),
+                        on_result,
+                        PRIORITY_BROADCAST,
+                    )
+                finally:
+                    # Сохраняем прогресс и при остановке посреди пачки
+                    last_user_id, batch_successful, batch_failed = _completed_prefix(
+                        batch, results
+                    )
+                    if last_user_id is not None:
+                        cursor_user_id = last_user_id
+                        successful += batch_successful
+                        failed += batch_failed
+                        await checkpoint_broadcast_job(
+                            job_id, cursor_user_id, successful, failed
                         )
-                    successful += 1
-                    log.write(f"User {user_id}: SUCCESS\n")
-                    logger.debug(f"Sent signal to user {user_id}")
-                except TelegramForbiddenError:
-                    # Пользователь заблокировал бота
-                    failed += 1
-                    error_msg = "User blocked the bot"
-                    log.write(f"User {user_id}: FAILED - {error_msg}\n")
-                    logger.warning(f"User {user_id} blocked the bot")
-                except TelegramBadRequest as e:
-                    # Другая ошибка
-                    failed += 1
-                    error_msg = str(e)
-                    log.write(f"User {user_id}: FAILED - {error_msg}\n")
-                    logger.error(f"Failed to send to user {user_id}: {e}")
-                except Exception as e:
-                    # Неожиданная ошибка
-                    failed += 1
-                    error_msg = str(e)
-                    log.write(f"User {user_id}: FAILED - {error_msg}\n")
-                    logger.error(f"Unexpected error sending to user {user_id}: {e}")
-
-                # Небольшая задержка между отправками
-                await asyncio.sleep(0.05)
+                    log.flush()
+                    # Заблокировавших бота исключаем из следующих рассылок
+                    await dead_recipients.flush()
 
             log.write("\nSummary:\n")
             log.write(f"Successful: {successful}\n")
             log.write(f"Failed: {failed}\n")
 
-        logger.info(f"Broadcast completed: {successful} successful, {failed} failed")
+        # Завершенное задание больше нельзя приостановить или отменить
+        _unregister(admin_id)
+        await set_broadcast_job_status(job_id, "done")
+        logger.info(
+            f"Broadcast {job_id} completed: {successful} successful, {failed} failed"
+        )
 
         # Отправляем результат админу
         result_text = (
             f"✅ Рассылка завершена!\n\n"
-            f"Всего получателей: {total_users}\n"
+            f"Всего получателей: {successful + failed}\n"
             f"Успешно отправлено: {successful}\n"
             f"Ошибок: {failed}"
         )
 
         try:
             await bot.send_message(admin_id, result_text)
-
-            # Отправляем файл лога
-            if log_file.exists():
-                document = FSInputFile(str(log_file))
-                await bot.send_document(
-                    chat_id=admin_id, document=document, caption="📄 Лог рассылки"
-                )
+            await _send_log_file(bot, admin_id, log_file)
         except Exception as e:
             logger.error(f"Failed to send result to admin {admin_id}: {e}")
 
     except asyncio.CancelledError:
-        # Если задача была отменена
-        logger.warning(f"Broadcast task was cancelled for admin {admin_id}")
-        try:
-            await bot.send_message(
-                admin_id,
+        reason = _stop_requests.pop(admin_id, None)
+        if reason is None:
+            # Остановка бота: задание остается running и продолжится при запуске
+            logger.warning(
+                f"Broadcast {job_id} interrupted at user {cursor_user_id}, will resume on startup"
+            )
+            raise
+
+        # Задание могло успеть завершиться: тогда статус done не меняем
+        if not await set_broadcast_job_status(job_id, reason, "running"):
+            logger.info(f"Broadcast {job_id} already finished, {reason} ignored")
+            return
+        if reason == "paused":
+            logger.info(f"Broadcast {job_id} paused at user {cursor_user_id}")
+            text = (
+                f"⏸ Рассылка приостановлена.\n\n"
+                f"✅ Успешно отправлено: {successful}\n"
+                f"❌ Ошибок: {failed}\n\n"
+                f"Продолжить: /resume_broadcast\n"
+                f"Отменить: /cancel_broadcast"
+            )
+        else:
+            logger.warning(f"Broadcast task was cancelled for admin {admin_id}")
+            text = (
                 f"❗️ Рассылка была принудительно остановлена.\n\n"
                 f"✅ Успешно отправлено: {successful}\n"
-                f"❌ Ошибок: {failed}",
+                f"❌ Ошибок: {failed}"
             )
-            # Отправляем файл лога, если он был создан
-            if log_file.exists():
-                document = FSInputFile(str(log_file))
-                await bot.send_document(
-                    chat_id=admin_id, document=document, caption="📄 Лог рассылки"
-                )
+        try:
+            await bot.send_message(admin_id, text)
+            if reason == "cancelled":
+                await _send_log_file(bot, admin_id, log_file)
         except Exception as e:
-            logger.error(
-                f"Failed to send cancellation message to admin {admin_id}: {e}"
-            )
+            logger.error(f"Failed to send stop message to admin {admin_id}: {e}")
     except Exception as e:
         logger.error(f"Error in broadcast task: {e}", exc_info=True)
         try:
@@ -160,14 +271,18 @@ async def send_broadcast_task(
             pass
     finally:
         # Очистка в любом случае
-        if admin_id in active_broadcasts:
-            del active_broadcasts[admin_id]
-            logger.info(
-                f"Broadcast task removed from active_broadcasts for admin {admin_id}"
-            )
+        _stop_requests.pop(admin_id, None)
+        _unregister(admin_id)
 
 
-def start_broadcast_task(
+def _run_job(bot: Bot, job: dict) -> asyncio.Task:
+    """Запуск задачи для задания рассылки"""
+    task = asyncio.create_task(send_broadcast_task(bot, job))
+    active_broadcasts[job["admin_id"]] = task
+    return task
+
+
+async def start_broadcast_task(
     bot: Bot,
     photo_file_id: str | None,
     caption: str,
@@ -175,7 +290,7 @@ def start_broadcast_task(
     parse_mode: str = "HTML",
 ) -> asyncio.Task | None:
     """
-    Запустить рассылку в фоновом режиме.
+    Создать задание рассылки и запустить его в фоновом режиме.
 
     Args:
         bot: Экземпляр бота
@@ -188,35 +303,141 @@ def start_broadcast_task(
         asyncio.Task - задача рассылки или None, если уже есть активная рассылка
     """
     # Проверяем, есть ли уже активная рассылка для этого админа
-    if admin_id in active_broadcasts:
+    if not _reserve(admin_id):
         logger.warning(
             f"Admin {admin_id} tried to start broadcast while one is already active"
         )
         return None
 
-    task = asyncio.create_task(
-        send_broadcast_task(bot, photo_file_id, caption, admin_id, parse_mode)
-    )
-    active_broadcasts[admin_id] = task
-    logger.info(f"Broadcast task started for admin {admin_id}")
+    try:
+        log_file = (
+            Path(BROADCAST_LOGS_DIR)
+            / f"broadcast_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        )
+        total_users = await count_active_users()
+        job_id = await create_broadcast_job(
+            admin_id, photo_file_id, caption, parse_mode, total_users, str(log_file)
+        )
+        job = {
+            "id": job_id,
+            "admin_id": admin_id,
+            "photo_file_id": photo_file_id,
+            "caption": caption,
+            "parse_mode": parse_mode,
+            "status": "running",
+            "cursor_user_id": 0,
+            "total_users": total_users,
+            "successful": 0,
+            "failed": 0,
+            "log_file": str(log_file),
+        }
+
+        task = _run_job(bot, job)
+    finally:
+        _starting.discard(admin_id)
+    logger.info(f"Broadcast task {job_id} started for admin {admin_id}")
     return task
 
 
-def cancel_broadcast(admin_id: int) -> bool:
+async def get_paused_broadcast(admin_id: int) -> dict | None:
+    """Последнее приостановленное задание рассылки админа"""
+    jobs = await get_broadcast_jobs(["paused"], admin_id)
+    return jobs[-1] if jobs else None
+
+
+async def resume_broadcast(bot: Bot, admin_id: int) -> dict | None:
+    """
+    Продолжить приостановленную рассылку админа с сохраненного места.
+
+    Returns:
+        dict - задание рассылки или None, если продолжать нечего
+    """
+    if not _reserve(admin_id):
+        return None
+    try:
+        job = await get_paused_broadcast(admin_id)
+        if job is None:
+            return None
+
+        if not await set_broadcast_job_status(job["id"], "running", "paused"):
+            return None
+        job["status"] = "running"
+        _run_job(bot, job)
+    finally:
+        _starting.discard(admin_id)
+    logger.info(
+        f"Broadcast {job['id']} resumed for admin {admin_id} after user {job['cursor_user_id']}"
+    )
+    return job
+
+
+async def resume_pending_broadcasts(bot: Bot) -> int:
+    """
+    Продолжение рассылок, прерванных остановкой бота.
+
+    Returns:
+        int - количество продолженных рассылок
+    """
+    resumed = 0
+    for job in await get_broadcast_jobs(["running"]):
+        admin_id = job["admin_id"]
+        if admin_id in active_broadcasts:
+            # У одного админа одна активная рассылка, остальные ставим на паузу
+            await set_broadcast_job_status(job["id"], "paused")
+            continue
+        _run_job(bot, job)
+        resumed += 1
+        logger.info(
+            f"Broadcast {job['id']} resumed after restart from user {job['cursor_user_id']}"
+        )
+        try:
+            await bot.send_message(
+                admin_id,
+                f"🔄 Рассылка продолжена после перезапуска.\n\n"
+                f"Уже отправлено: {job['successful']}, ошибок: {job['failed']}",
+            )
+        except Exception as e:
+            logger.error(f"Failed to notify admin {admin_id} about resume: {e}")
+    return resumed
+
+
+def pause_broadcast(admin_id: int) -> bool:
     """
-    Отменить активную рассылку для админа.
+    Приостановить активную рассылку админа (прогресс сохраняется).
+
+    Returns:
+        bool - True, если остановка запрошена, False если не было активной рассылки
+    """
+    if admin_id in active_broadcasts:
+        _stop_requests[admin_id] = "paused"
+        active_broadcasts[admin_id].cancel()
+        logger.info(f"Broadcast pause requested for admin {admin_id}")
+        return True
+    return False
+
+
+async def cancel_broadcast(admin_id: int) -> bool:
+    """
+    Отменить активную или приостановленную рассылку для админа.
 
     Args:
         admin_id: ID админа
 
     Returns:
-        bool - True, если рассылка была отменена, False если не было активной рассылки
+        bool - True, если рассылка была отменена, False если отменять нечего
     """
     if admin_id in active_broadcasts:
         task = active_broadcasts[admin_id]
+        _stop_requests[admin_id] = "cancelled"
         task.cancel()
         logger.info(f"Broadcast cancellation requested for admin {admin_id}")
         return True
+
+    job = await get_paused_broadcast(admin_id)
+    if job is not None:
+        await set_broadcast_job_status(job["id"], "cancelled")
+        logger.info(f"Paused broadcast {job['id']} cancelled for admin {admin_id}")
+        return True
     return False
 
 
@@ -230,4 +451,4 @@ def has_active_broadcast(admin_id: int) -> bool:
     Returns:
         bool - True, если есть активная рассылка, False иначе
     """
-    return admin_id in active_broadcasts
+    return admin_id in active_broadcasts or admin_id in _starting
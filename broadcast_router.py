@@ -9,7 +9,14 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from broadcast import cancel_broadcast, has_active_broadcast, start_broadcast_task
+from broadcast import (
+    cancel_broadcast,
+    get_paused_broadcast,
+    has_active_broadcast,
+    pause_broadcast,
+    resume_broadcast,
+    start_broadcast_task,
+)
 from config import ADMIN_ID
 
 logger = logging.getLogger(__name__)
@@ -86,6 +93,14 @@ async def cmd_broadcast(message: types.Message, state: FSMContext):
         )
         return
 
+    # Приостановленную рассылку нужно продолжить или отменить
+    if await get_paused_broadcast(user.id):
+        await message.answer(
+            "⚠️ У вас есть приостановленная рассылка. Используйте /resume_broadcast для продолжения или /cancel_broadcast для отмены.",
+            parse_mode="HTML",
+        )
+        return
+
     # Переходим в состояние ожидания сообщения
     await state.set_state(BroadcastStates.waiting_message)
     keyboard = create_broadcast_keyboard()
@@ -109,13 +124,53 @@ async def cmd_cancel_broadcast(message: types.Message, state: FSMContext):
     # Сбрасываем состояние
     await state.clear()
 
-    # Отменяем активную рассылку
-    if cancel_broadcast(user.id):
-        await message.answer("✅ Активная рассылка отменена.", parse_mode="HTML")
+    # Отменяем активную или приостановленную рассылку
+    if await cancel_broadcast(user.id):
+        await message.answer("✅ Рассылка отменена.", parse_mode="HTML")
     else:
         await message.answer("ℹ️ Нет активной рассылки для отмены.", parse_mode="HTML")
 
 
+@broadcast_router.message(Command("pause_broadcast"))
+async def cmd_pause_broadcast(message: types.Message):
+    """Обработчик команды /pause_broadcast для админа."""
+    if not is_admin(message):
+        return
+
+    user = message.from_user
+    logger.info(f"Команда /pause_broadcast от админа {user.id}")
+
+    # Итог с количеством отправленных придет от задачи рассылки
+    if not pause_broadcast(user.id):
+        await message.answer(
+            "ℹ️ Нет активной рассылки для приостановки.", parse_mode="HTML"
+        )
+
+
+@broadcast_router.message(Command("resume_broadcast"))
+async def cmd_resume_broadcast(message: types.Message, bot: Bot):
+    """Обработчик команды /resume_broadcast для админа."""
+    if not is_admin(message):
+        return
+
+    user = message.from_user
+    logger.info(f"Команда /resume_broadcast от админа {user.id}")
+
+    if has_active_broadcast(user.id):
+        await message.answer("⚠️ Рассылка уже выполняется.", parse_mode="HTML")
+        return
+
+    job = await resume_broadcast(bot, user.id)
+    if job:
+        await message.answer(
+            f"▶️ Рассылка продолжена.\n\n"
+            f"Уже отправлено: {job['successful']}, ошибок: {job['failed']}",
+            parse_mode="HTML",
+        )
+    else:
+        await message.answer("ℹ️ Нет приостановленной рассылки.", parse_mode="HTML")
+
+
 @broadcast_router.callback_query(
     lambda c: c.data == "broadcast_cancel", StateFilter(BroadcastStates)
 )
@@ -232,7 +287,7 @@ async def callback_confirm(callback: types.CallbackQuery, state: FSMContext, bot
         return
 
     # Запускаем рассылку
-    task = start_broadcast_task(
+    task = await start_broadcast_task(
         bot=bot,
         photo_file_id=photo_file_id,
         caption=caption,
@@ -0,0 +1,122 @@
+"""Объединение всех уведомлений пользователя за цикл проверки в одно сообщение."""
+
+import logging
+
+from diff_engine import PIGGYBANK_LINK
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Подпись, которая добавляется к каждому уведомлению при отправке
+NOTIFICATION_FOOTER = "\n\nSay /thankyou 😊"
+# Разделитель между событиями в объединенном сообщении
+PART_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+# Ссылка в конце каждого уведомления (в объединенном сообщении - одна)
+LINK_SUFFIX = f"\n\n{PIGGYBANK_LINK}"
+
+
+def _strip_link(message: str) -> str:
+    """Текст события без ссылки на платформу в конце"""
+    if message.endswith(LINK_SUFFIX):
+        return message[: -len(LINK_SUFFIX)]
+    return message
+
+
+def text_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram (в UTF-16 code units)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def pack_parts(parts: list[str], separator: str = PART_SEPARATOR) -> list[str]:
+    """
+    Склейка частей в сообщения, не превышающие лимит Telegram
+    с учетом ссылки и подписи.
+    """
+    budget = (
+        TELEGRAM_MESSAGE_LIMIT
+        - text_length(LINK_SUFFIX)
+        - text_length(NOTIFICATION_FOOTER)
+    )
+    messages = []
+    current = ""
+    for part in parts:
+        candidate = f"{current}{separator}{part}" if current else part
+        if current and text_length(candidate) > budget:
+            messages.append(current + LINK_SUFFIX)
+            current = part
+        else:
+            current = candidate
+    if current:
+        messages.append(current + LINK_SUFFIX)
+    return messages
+
+
+def coalesce_notifications(notifications: list[dict]) -> list[dict]:
+    """
+    Объединение уведомлений по получателям.
+
+    Все события одного пользователя за цикл превращаются в одно сообщение
+    (или несколько, если не помещаются в 4096 символов).
+
+    Args:
+        notifications: Уведомления с ключами type, asset_ticker, users,
+            message, priority
+
+    Returns:
+        list - сообщения с ключами user_id, type, asset_ticker, message, priority
+    """
+    # Для каждого пользователя - индексы его уведомлений в порядке событий
+    by_user: dict[int, list[int]] = {}
+    for index, notification in enumerate(notifications):
+        for user_id in notification.get("users", []):
+            by_user.setdefault(user_id, []).append(index)
+
+    # Пользователи с одинаковым набором событий получают одинаковый текст
+    rendered: dict[tuple, list[dict]] = {}
+    messages = []
+    for user_id, indexes in by_user.items():
+        key = tuple(indexes)
+        if key not in rendered:
+            rendered[key] = _render([notifications[index] for index in indexes])
+        for message in rendered[key]:
+            messages.append({**message, "user_id": user_id})
+
+    events_total = sum(len(indexes) for indexes in by_user.values())
+    if events_total:
+        logger.info(
+            f"Объединение уведомлений: событий для пользователей {events_total}, сообщений {len(messages)}"
+        )
+    return messages
+
+
+def _render(user_notifications: list[dict]) -> list[dict]:
+    """Сообщения для одного набора событий пользователя"""
+    priority = min(
+        notification.get("priority", 0) for notification in user_notifications
+    )
+
+    if len(user_notifications) == 1:
+        notification = user_notifications[0]
+        return [
+            {
+                "type": notification.get("type"),
+                "asset_ticker": notification.get("asset_ticker"),
+                "message": notification.get("message", ""),
+                "priority": priority,
+            }
+        ]
+
+    parts = [
+        _strip_link(notification.get("message", ""))
+        for notification in user_notifications
+    ]
+    return [
+        {
+            "type": "combined",
+            "asset_ticker": None,
+            "message": message,
+            "priority": priority,
+        }
+        for message in pack_parts(parts)
+    ]
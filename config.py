@@ -22,6 +22,93 @@ TEST_API = os.getenv("TEST_API", "false").lower() in ("true", "1", "yes", "on")
 # Proxy configuration (optional)
 PROXY = os.getenv("PROXY", "")
 
+# HTTP client configuration (общая сессия с пулом соединений)
+# Таймаут одного запроса к API в секундах
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+# Максимальное количество соединений в пуле
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+# Время кэширования DNS в секундах
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+# Время жизни неактивного keep-alive соединения в секундах
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "75"))
+
+# Время актуальности кэша активов в секундах
+# Должно быть больше интервала проверки (60 сек), чтобы обработчики читали из памяти
+ASSETS_CACHE_TTL = float(os.getenv("ASSETS_CACHE_TTL", "90"))
+
+# Интервал сверки индекса подписок в памяти с БД в секундах
+SUBSCRIPTION_INDEX_VERIFY_INTERVAL = int(
+    os.getenv("SUBSCRIPTION_INDEX_VERIFY_INTERVAL", "3600")
+)
+# Интервал пересчета счетчиков статистики с нуля в секундах
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", "86400"))
+
+# Message delivery configuration (лимиты Telegram Bot API)
+# Общий лимит сообщений в секунду для всего бота
+SEND_RATE_GLOBAL = float(os.getenv("SEND_RATE_GLOBAL", "25"))
+# Лимит сообщений в секунду в один чат и допустимая серия подряд
+SEND_RATE_PER_CHAT = float(os.getenv("SEND_RATE_PER_CHAT", "1"))
+SEND_BURST_PER_CHAT = float(os.getenv("SEND_BURST_PER_CHAT", "3"))
+# Количество одновременных отправок (воркеров)
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "16"))
+# Размер очереди отправки (при заполнении постановка новых сообщений ждет)
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "1000"))
+# Повторы при временных ошибках (RetryAfter, сеть, 5xx)
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+# Базовая и максимальная задержка экспоненциального повтора в секундах
+SEND_RETRY_BASE_DELAY = float(os.getenv("SEND_RETRY_BASE_DELAY", "1"))
+SEND_RETRY_MAX_DELAY = float(os.getenv("SEND_RETRY_MAX_DELAY", "60"))
+# Нижняя граница общего лимита при снижении после RetryAfter
+SEND_RATE_MIN = float(os.getenv("SEND_RATE_MIN", "1"))
+
+# Notification outbox configuration (очередь уведомлений в БД)
+# Сколько уведомлений брать из очереди за один раз
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+# Интервал проверки очереди без новых уведомлений в секундах
+OUTBOX_SWEEP_INTERVAL = float(os.getenv("OUTBOX_SWEEP_INTERVAL", "60"))
+# Сколько дней хранить обработанные уведомления
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+# SQLite connection configuration (долгоживущие соединения в режиме WAL)
+# Размер кэша подготовленных запросов на соединение
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+# Сколько секунд ждать освобождения блокировки БД
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+
+# User profile cache (отложенная запись профилей при /start)
+# Сколько профилей держать в памяти
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Интервал записи изменений в БД в секундах
+USER_CACHE_FLUSH_INTERVAL = float(os.getenv("USER_CACHE_FLUSH_INTERVAL", "5"))
+# Записывать раньше интервала, если накопилось столько изменений
+USER_CACHE_FLUSH_BATCH = int(os.getenv("USER_CACHE_FLUSH_BATCH", "500"))
+
+# Размер пачки при потоковом обходе всех пользователей (анонсы, рассылки)
+USER_PAGE_SIZE = int(os.getenv("USER_PAGE_SIZE", "1000"))
+
+# Broadcast configuration
+# Сколько получателей рассылки обрабатывать между сохранениями прогресса
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+
+# Digest mode configuration (уведомления одним сообщением по расписанию)
+# Интервал проверки наступивших дайджестов в секундах
+DIGEST_CHECK_INTERVAL = float(os.getenv("DIGEST_CHECK_INTERVAL", "60"))
+# Сколько пользователей обрабатывать за один раз
+DIGEST_BATCH_SIZE = int(os.getenv("DIGEST_BATCH_SIZE", "200"))
+
+# Экспорт таблиц в /get_data
+# Сколько строк читать из БД за один раз
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+# Максимальный размер одного файла в МБ (лимит загрузки Telegram - 50 МБ)
+EXPORT_PART_SIZE = int(float(os.getenv("EXPORT_PART_SIZE_MB", "45")) * 1024 * 1024)
+
+# Прогноз заполнения: за сколько секунд вес значения TVL уменьшается вдвое
+FORECAST_HALF_LIFE = float(os.getenv("FORECAST_HALF_LIFE", "3600"))
+
+# История снимков активов
+# Через сколько дельт записывать полный ключевой кадр
+SNAPSHOT_KEYFRAME_INTERVAL = int(os.getenv("SNAPSHOT_KEYFRAME_INTERVAL", "100"))
+
 # Data directory configuration
 DATA_DIR = os.getenv("DATA_DIR", "")
 if DATA_DIR:
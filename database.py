@@ -1,232 +1,923 @@
-import csv
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 
 import aiosqlite
 
-from config import DB_FILE
+from config import DB_BUSY_TIMEOUT, DB_CACHED_STATEMENTS, DB_FILE, USER_PAGE_SIZE
+from migrations import STAT_COUNTERS, rebuild_statistics, run_migrations
 
 logger = logging.getLogger(__name__)
 
+# Максимальное количество параметров в одном запросе (лимит старых версий SQLite)
+SQLITE_MAX_PARAMS = 900
+
+# Долгоживущие соединения: одно для записи, одно для чтения.
+# В режиме WAL чтение не ждет записи и видит только зафиксированные данные
+_write_db: aiosqlite.Connection | None = None
+_read_db: aiosqlite.Connection | None = None
+# Транзакции на общем соединении записи выполняются по очереди
+_write_lock = asyncio.Lock()
+
+
+async def _open_connection() -> aiosqlite.Connection:
+    """Открытие соединения с настройками для долгой работы"""
+    db = await aiosqlite.connect(DB_FILE, cached_statements=DB_CACHED_STATEMENTS)
+    await db.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+    # WAL: читатели не блокируются писателем; NORMAL достаточно надежен для WAL
+    await db.execute("PRAGMA journal_mode = WAL")
+    await db.execute("PRAGMA synchronous = NORMAL")
+    await db.execute("PRAGMA temp_store = MEMORY")
+    return db
+
+
+async def connect_db():
+    """Открытие соединений с БД (вызывается при запуске, повторный вызов ничего не делает)"""
+    global _write_db, _read_db
+    if _write_db is not None:
+        return
+    _write_db = await _open_connection()
+    _read_db = await _open_connection()
+    logger.info(f"Подключение к базе данных {DB_FILE} открыто (WAL)")
+
+
+async def close_db():
+    """Закрытие соединений с БД при остановке"""
+    global _write_db, _read_db
+    connections = [db for db in (_write_db, _read_db) if db is not None]
+    _write_db = None
+    _read_db = None
+    for db in connections:
+        await db.close()
+    if connections:
+        logger.info("Подключение к базе данных закрыто")
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Транзакция на общем соединении записи.
+    Фиксируется при выходе из блока, откатывается при исключении.
+    """
+    if _write_db is None:
+        raise RuntimeError("База данных не подключена, вызовите connect_db()")
+    async with _write_lock:
+        try:
+            yield _write_db
+            await _write_db.commit()
+        except BaseException:
+            await _write_db.rollback()
+            raise
+
+
+@asynccontextmanager
+async def read_connection():
+    """
+    Общее соединение для чтения.
+    Результаты читаются целиком через fetchall(): пока курсор открыт, все чтения
+    на соединении видят его снимок WAL и не замечают новых коммитов.
+    """
+    if _read_db is None:
+        raise RuntimeError("База данных не подключена, вызовите connect_db()")
+    yield _read_db
+
 
 async def init_db():
-    """Инициализация базы данных"""
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS user_subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                asset_ticker TEXT NOT NULL,
-                asset_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, asset_ticker),
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
-        await db.commit()
-
-
-async def save_user(
-    user_id: int, username: str = None, first_name: str = None, last_name: str = None
-):
-    """Сохранение пользователя в базу данных"""
+    """Инициализация базы данных: подключение и миграции схемы"""
+    await connect_db()
+    async with _write_lock:
+        version = await run_migrations(_write_db)
+    logger.info(f"Версия схемы БД: {version}")
+
+
+# Сохранение пользователя: created_at не меняется, повторный /start возвращает в рассылки
+_UPSERT_USER_SQL = """
+    INSERT INTO users (user_id, username, first_name, last_name, is_active)
+    VALUES (?, ?, ?, ?, 1)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        is_active = 1,
+        deactivated_at = NULL,
+        deactivation_reason = NULL
+"""
+
+
+async def save_users(rows) -> int:
+    """Сохранение пачки пользователей одной транзакцией
+    rows - кортежи (user_id, username, first_name, last_name)"""
+    rows = list(rows)
+    if not rows:
+        return 0
+
     try:
-        async with aiosqlite.connect(DB_FILE) as db:
-            await db.execute(
+        async with transaction() as db:
+            await db.executemany(_UPSERT_USER_SQL, rows)
+            return len(rows)
+    except Exception as e:
+        logger.error(
+            f"Ошибка при сохранении {len(rows)} пользователей: {e}", exc_info=True
+        )
+        raise
+
+
+async def get_user_profile(user_id: int) -> tuple | None:
+    """Профиль активного пользователя (username, first_name, last_name)
+    Возвращает None, если пользователя нет или он неактивен"""
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute(
                 """
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
+                SELECT username, first_name, last_name FROM users 
+                WHERE user_id = ? AND is_active = 1
             """,
-                (user_id, username, first_name, last_name),
+                (user_id,),
             )
-            await db.commit()
+            row = await cursor.fetchone()
+            return tuple(row) if row else None
     except Exception as e:
         logger.error(
-            f"Ошибка при сохранении пользователя {user_id}: {e}", exc_info=True
+            f"Ошибка при получении профиля пользователя {user_id}: {e}", exc_info=True
         )
-        raise
+        return None
 
 
 async def toggle_subscription(user_id: int, asset_ticker: str, asset_name: str = None):
     """Переключение подписки пользователя на актив"""
     try:
-        async with aiosqlite.connect(DB_FILE) as db:
-            # Проверяем, есть ли уже подписка
+        async with transaction() as db:
+            # Пробуем удалить подписку: если она была, переключение - это отписка
             cursor = await db.execute(
                 """
-                SELECT id FROM user_subscriptions 
-                WHERE user_id = ? AND asset_ticker = ?
+                DELETE FROM user_subscriptions 
+                WHERE user_id = ?
+                AND asset_id = (SELECT asset_id FROM assets WHERE asset_ticker = ?)
             """,
                 (user_id, asset_ticker),
             )
-            existing = await cursor.fetchone()
-
-            if existing:
-                # Удаляем подписку
-                await db.execute(
-                    """
-                    DELETE FROM user_subscriptions 
-                    WHERE user_id = ? AND asset_ticker = ?
-                """,
-                    (user_id, asset_ticker),
-                )
-                await db.commit()
+            if cursor.rowcount:
                 return False  # Подписка отменена
-            else:
-                # Добавляем подписку
-                await db.execute(
-                    """
-                    INSERT INTO user_subscriptions (user_id, asset_ticker, asset_name)
-                    VALUES (?, ?, ?)
+
+            # Добавляем актив в справочник (или обновляем название) и подписку
+            await db.execute(
+                """
+                INSERT INTO assets (asset_ticker, asset_name) VALUES (?, ?)
+                ON CONFLICT(asset_ticker) DO UPDATE SET
+                    asset_name = COALESCE(excluded.asset_name, asset_name)
+            """,
+                (asset_ticker, asset_name),
+            )
+            await db.execute(
+                """
+                INSERT INTO user_subscriptions (user_id, asset_id)
+                SELECT ?, asset_id FROM assets WHERE asset_ticker = ?
+            """,
+                (user_id, asset_ticker),
+            )
+            return True  # Подписка добавлена
+    except Exception as e:
+        logger.error(
+            f"Ошибка при переключении подписки пользователя {user_id} на {asset_ticker}: {e}",
+            exc_info=True,
+        )
+        raise
+
+
+async def get_all_subscriptions():
+    """Получение всех пар (user_id, asset_ticker) для построения индекса подписок"""
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute("""
+                SELECT s.user_id, a.asset_ticker FROM user_subscriptions s
+                JOIN assets a ON a.asset_id = s.asset_id
+            """)
+            return [(row[0], row[1]) for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка при получении всех подписок: {e}", exc_info=True)
+        raise
+
+
+async def get_subscribers_by_tickers(asset_tickers) -> dict[str, list[int]]:
+    """Получение подписчиков сразу для набора активов одним запросом
+    Возвращает словарь {asset_ticker: [user_id, ...]} только для активов с подписчиками"""
+    tickers = list(dict.fromkeys(asset_tickers))
+    subscribers = {}
+    if not tickers:
+        return subscribers
+
+    try:
+        async with read_connection() as db:
+            # Делим на части, чтобы не превысить лимит параметров SQLite
+            for start in range(0, len(tickers), SQLITE_MAX_PARAMS):
+                chunk = tickers[start : start + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                # Подписчики читаются по индексу (asset_id, user_id)
+                cursor = await db.execute(
+                    f"""
+                    SELECT a.asset_ticker, s.user_id FROM assets a
+                    JOIN user_subscriptions s ON s.asset_id = a.asset_id
+                    WHERE a.asset_ticker IN ({placeholders})
+                    AND s.user_id NOT IN (SELECT user_id FROM users WHERE is_active = 0)
                 """,
-                    (user_id, asset_ticker, asset_name),
+                    chunk,
                 )
-                await db.commit()
-                return True  # Подписка добавлена
+                for asset_ticker, user_id in await cursor.fetchall():
+                    subscribers.setdefault(asset_ticker, []).append(user_id)
+            return subscribers
     except Exception as e:
         logger.error(
-            f"Ошибка при переключении подписки пользователя {user_id} на {asset_ticker}: {e}",
+            f"Ошибка при получении подписчиков для {len(tickers)} активов: {e}",
+            exc_info=True,
+        )
+        return {}  # Возвращаем пустой словарь при ошибке
+
+
+async def get_user_ids_page(after_user_id: int, limit: int) -> list[int]:
+    """Следующая страница активных пользователей по возрастанию user_id
+    (постраничный обход по ключу, без OFFSET)"""
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute(
+                """
+                SELECT user_id FROM users 
+                WHERE is_active = 1 AND user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+            """,
+                (after_user_id, limit),
+            )
+            return [row[0] for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(
+            f"Ошибка при получении пользователей после {after_user_id}: {e}",
+            exc_info=True,
+        )
+        raise
+
+
+async def iter_user_ids(batch_size: int = USER_PAGE_SIZE, after_user_id: int = 0):
+    """Потоковый обход активных пользователей пачками по первичному ключу
+    Выдает списки user_id по возрастанию; в памяти одновременно только одна пачка"""
+    while True:
+        batch = await get_user_ids_page(after_user_id, batch_size)
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after_user_id = batch[-1]
+
+
+async def count_active_users() -> int:
+    """Количество активных пользователей"""
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM users WHERE is_active = 1")
+            return (await cursor.fetchone())[0]
+    except Exception as e:
+        logger.error(f"Ошибка при подсчете активных пользователей: {e}", exc_info=True)
+        raise
+
+
+async def get_inactive_user_ids():
+    """Получение множества пользователей, отмеченных как неактивные"""
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute("""
+                SELECT user_id FROM users WHERE is_active = 0
+            """)
+            return {row[0] for row in await cursor.fetchall()}
+    except Exception as e:
+        logger.error(
+            f"Ошибка при получении неактивных пользователей: {e}", exc_info=True
+        )
+        raise
+
+
+async def deactivate_users(reasons: dict[int, str]):
+    """Отметка пользователей как неактивных (заблокировали бота, удалили аккаунт)
+    reasons - словарь {user_id: причина}"""
+    if not reasons:
+        return
+
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                """
+                UPDATE users 
+                SET is_active = 0, deactivated_at = CURRENT_TIMESTAMP, deactivation_reason = ?
+                WHERE user_id = ? AND is_active = 1
+            """,
+                [(reason, user_id) for user_id, reason in reasons.items()],
+            )
+    except Exception as e:
+        logger.error(
+            f"Ошибка при отметке {len(reasons)} пользователей как неактивных: {e}",
+            exc_info=True,
+        )
+        raise
+
+
+async def enqueue_notifications(rows) -> int:
+    """Добавление уведомлений в очередь одной транзакцией
+    rows - кортежи (user_id, notification_type, asset_ticker, message, priority)"""
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                """
+                INSERT INTO notification_outbox (user_id, notification_type, asset_ticker, message, priority)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                rows,
+            )
+            return len(rows)
+    except Exception as e:
+        logger.error(
+            f"Ошибка при добавлении {len(rows)} уведомлений в очередь: {e}",
             exc_info=True,
         )
         raise
 
 
-async def get_user_subscriptions(user_id: int):
-    """Получение списка подписок пользователя"""
+async def get_pending_notifications(priority: int, limit: int):
+    """Получение пачки неотправленных уведомлений класса priority в порядке добавления
+    Возвращает список кортежей (id, user_id, message)"""
     try:
-        async with aiosqlite.connect(DB_FILE) as db:
+        async with read_connection() as db:
             cursor = await db.execute(
                 """
-                SELECT asset_ticker FROM user_subscriptions 
-                WHERE user_id = ?
+                SELECT id, user_id, message FROM notification_outbox 
+                WHERE status = 'pending' AND priority = ?
+                ORDER BY id
+                LIMIT ?
             """,
-                (user_id,),
+                (priority, limit),
+            )
+            return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при получении очереди уведомлений: {e}", exc_info=True)
+        raise
+
+
+async def mark_notifications_sent(ids):
+    """Отметка уведомлений как доставленных"""
+    ids = list(ids)
+    if not ids:
+        return
+
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                """
+                UPDATE notification_outbox 
+                SET status = 'sent', sent_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """,
+                [(notification_id,) for notification_id in ids],
+            )
+    except Exception as e:
+        logger.error(
+            f"Ошибка при отметке {len(ids)} уведомлений как отправленных: {e}",
+            exc_info=True,
+        )
+        raise
+
+
+async def mark_notifications_failed(failures):
+    """Отметка уведомлений, которые не удалось доставить
+    failures - пары (id, текст ошибки)"""
+    failures = list(failures)
+    if not failures:
+        return
+
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                """
+                UPDATE notification_outbox 
+                SET status = 'failed', last_error = ?
+                WHERE id = ?
+            """,
+                [(error, notification_id) for notification_id, error in failures],
             )
-            rows = await cursor.fetchall()
-            return {row[0] for row in rows}  # Возвращаем set для быстрой проверки
     except Exception as e:
         logger.error(
-            f"Ошибка при получении подписок пользователя {user_id}: {e}", exc_info=True
+            f"Ошибка при отметке {len(failures)} уведомлений как неудачных: {e}",
+            exc_info=True,
         )
-        return set()  # Возвращаем пустой set при ошибке
+        raise
 
 
-async def get_subscribed_users(asset_ticker: str):
-    """Получение списка пользователей, подписанных на конкретный актив"""
+async def delete_old_notifications(days: int) -> int:
+    """Удаление обработанных уведомлений старше указанного количества дней"""
     try:
-        async with aiosqlite.connect(DB_FILE) as db:
+        async with transaction() as db:
             cursor = await db.execute(
                 """
-                SELECT user_id FROM user_subscriptions 
-                WHERE asset_ticker = ?
+                DELETE FROM notification_outbox 
+                WHERE status != 'pending' AND created_at < datetime('now', ?)
             """,
-                (asset_ticker,),
+                (f"-{days} days",),
             )
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]  # Возвращаем список user_id
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка при очистке очереди уведомлений: {e}", exc_info=True)
+        return 0
+
+
+async def create_broadcast_job(
+    admin_id: int,
+    photo_file_id: str | None,
+    caption: str,
+    parse_mode: str | None,
+    total_users: int,
+    log_file: str,
+) -> int:
+    """Создание задания рассылки, возвращает его id"""
+    try:
+        async with transaction() as db:
+            cursor = await db.execute(
+                """
+                INSERT INTO broadcast_jobs (admin_id, photo_file_id, caption, parse_mode, total_users, log_file)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                (admin_id, photo_file_id, caption, parse_mode, total_users, log_file),
+            )
+            return cursor.lastrowid
+    except Exception as e:
+        logger.error(
+            f"Ошибка при создании задания рассылки админа {admin_id}: {e}",
+            exc_info=True,
+        )
+        raise
+
+
+async def get_broadcast_jobs(statuses, admin_id: int = None) -> list[dict]:
+    """Задания рассылки с указанными статусами (от старых к новым)"""
+    statuses = list(statuses)
+    placeholders = ",".join("?" * len(statuses))
+    query = f"SELECT * FROM broadcast_jobs WHERE status IN ({placeholders})"
+    params = statuses
+    if admin_id is not None:
+        query += " AND admin_id = ?"
+        params = statuses + [admin_id]
+    query += " ORDER BY id"
+
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка при получении заданий рассылки: {e}", exc_info=True)
+        raise
+
+
+async def checkpoint_broadcast_job(
+    job_id: int, cursor_user_id: int, successful: int, failed: int
+):
+    """Сохранение прогресса рассылки: все получатели до cursor_user_id обработаны"""
+    try:
+        async with transaction() as db:
+            await db.execute(
+                """
+                UPDATE broadcast_jobs 
+                SET cursor_user_id = ?, successful = ?, failed = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """,
+                (cursor_user_id, successful, failed, job_id),
+            )
+    except Exception as e:
+        logger.error(
+            f"Ошибка при сохранении прогресса рассылки {job_id}: {e}", exc_info=True
+        )
+        raise
+
+
+async def set_broadcast_job_status(
+    job_id: int, status: str, expected_status: str = None
+) -> bool:
+    """
+    Изменение статуса задания рассылки (running, paused, cancelled, done).
+    Если указан expected_status, статус меняется только из него.
+
+    Returns:
+        bool - True, если статус изменен
+    """
+    try:
+        async with transaction() as db:
+            cursor = await db.execute(
+                """
+                UPDATE broadcast_jobs 
+                SET status = ?, updated_at = CURRENT_TIMESTAMP,
+                    finished_at = CASE WHEN ? IN ('cancelled', 'done') THEN CURRENT_TIMESTAMP ELSE NULL END
+                WHERE id = ? AND (? IS NULL OR status = ?)
+            """,
+                (status, status, job_id, expected_status, expected_status),
+            )
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(
+            f"Ошибка при изменении статуса рассылки {job_id} на {status}: {e}",
+            exc_info=True,
+        )
+        raise
+
+
+async def get_digest_interval(user_id: int) -> int:
+    """Интервал дайджеста пользователя в секундах (0 - уведомления сразу)"""
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute(
+                """
+                SELECT interval_seconds FROM digest_settings WHERE user_id = ?
+            """,
+                (user_id,),
+            )
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+    except Exception as e:
+        logger.error(
+            f"Ошибка при получении интервала дайджеста пользователя {user_id}: {e}",
+            exc_info=True,
+        )
+        return 0
+
+
+async def set_digest_interval(user_id: int, interval_seconds: int):
+    """Установка интервала дайджеста (0 - отключить режим дайджеста)
+    При отключении накопленные события отправляются при ближайшей проверке"""
+    try:
+        async with transaction() as db:
+            if interval_seconds > 0:
+                # Уже запланированную отправку не переносим
+                await db.execute(
+                    """
+                    INSERT INTO digest_settings (user_id, interval_seconds)
+                    VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET interval_seconds = excluded.interval_seconds
+                """,
+                    (user_id, interval_seconds),
+                )
+            else:
+                await db.execute(
+                    """
+                    UPDATE digest_settings 
+                    SET interval_seconds = 0, due_at = CASE WHEN due_at IS NULL THEN NULL ELSE 0 END
+                    WHERE user_id = ?
+                """,
+                    (user_id,),
+                )
     except Exception as e:
         logger.error(
-            f"Ошибка при получении подписчиков актива {asset_ticker}: {e}",
+            f"Ошибка при установке интервала дайджеста пользователя {user_id}: {e}",
             exc_info=True,
         )
-        return []  # Возвращаем пустой список при ошибке
+        raise
 
 
-async def get_all_users():
-    """Получение списка всех пользователей"""
+async def get_digest_user_ids() -> set[int]:
+    """Множество пользователей в режиме дайджеста"""
     try:
-        async with aiosqlite.connect(DB_FILE) as db:
+        async with read_connection() as db:
             cursor = await db.execute("""
-                SELECT user_id FROM users
+                SELECT user_id FROM digest_settings WHERE interval_seconds > 0
             """)
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]  # Возвращаем список user_id
+            return {row[0] for row in await cursor.fetchall()}
     except Exception as e:
         logger.error(
-            f"Ошибка при получении списка всех пользователей: {e}", exc_info=True
+            f"Ошибка при получении пользователей в режиме дайджеста: {e}",
+            exc_info=True,
         )
-        return []  # Возвращаем пустой список при ошибке
+        raise
 
 
-async def export_table_to_csv(table_name: str, csv_file_path: str):
-    """Экспорт таблицы в CSV файл"""
+async def add_digest_events(rows, now: float) -> int:
+    """Добавление событий в дайджест с объединением по (пользователь, актив)
+    rows - кортежи (user_id, asset_ticker, asset_name, is_new, epoch_from, epoch_to,
+    tvl_change, cap_change, filled)
+    Для пользователей без запланированной отправки она назначается через их интервал"""
+    rows = list(rows)
+    if not rows:
+        return 0
+
     try:
-        async with aiosqlite.connect(DB_FILE) as db:
-            # Получаем данные из таблицы
-            cursor = await db.execute(f"SELECT * FROM {table_name}")
-            rows = await cursor.fetchall()
+        async with transaction() as db:
+            await db.executemany(
+                """
+                INSERT INTO digest_entries (
+                    user_id, asset_ticker, asset_name, is_new, epoch_from, epoch_to,
+                    tvl_change, cap_change, filled, events
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT(user_id, asset_ticker) DO UPDATE SET
+                    asset_name = excluded.asset_name,
+                    is_new = MAX(is_new, excluded.is_new),
+                    epoch_from = COALESCE(epoch_from, excluded.epoch_from),
+                    epoch_to = COALESCE(excluded.epoch_to, epoch_to),
+                    tvl_change = tvl_change + excluded.tvl_change,
+                    cap_change = cap_change + excluded.cap_change,
+                    filled = COALESCE(NULLIF(excluded.filled, ''), filled),
+                    events = events + 1,
+                    updated_at = CURRENT_TIMESTAMP
+            """,
+                rows,
+            )
+            await db.executemany(
+                """
+                UPDATE digest_settings 
+                SET due_at = ? + interval_seconds
+                WHERE user_id = ? AND due_at IS NULL
+            """,
+                [(now, user_id) for user_id in {row[0] for row in rows}],
+            )
+            return len(rows)
+    except Exception as e:
+        logger.error(
+            f"Ошибка при добавлении {len(rows)} событий в дайджест: {e}",
+            exc_info=True,
+        )
+        raise
+
 
-            # Получаем названия колонок
-            cursor = await db.execute(f"PRAGMA table_info({table_name})")
-            columns_info = await cursor.fetchall()
-            column_names = [col[1] for col in columns_info]
+async def get_due_digests(now: float, limit: int) -> dict[int, list[tuple]]:
+    """Накопленные события пользователей, у которых наступило время дайджеста
+    Возвращает словарь {user_id: [(asset_ticker, asset_name, is_new, epoch_from,
+    epoch_to, tvl_change, cap_change, filled, events), ...]}"""
+    # Пользователи передаются одним IN-списком
+    limit = min(limit, SQLITE_MAX_PARAMS)
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute(
+                """
+                SELECT user_id FROM digest_settings 
+                WHERE due_at IS NOT NULL AND due_at <= ?
+                ORDER BY due_at
+                LIMIT ?
+            """,
+                (now, limit),
+            )
+            user_ids = [row[0] for row in await cursor.fetchall()]
 
-            # Записываем в CSV
-            with open(csv_file_path, "w", newline="", encoding="utf-8") as csvfile:
-                writer = csv.writer(csvfile)
-                # Записываем заголовки
-                writer.writerow(column_names)
-                # Записываем данные
-                writer.writerows(rows)
+            digests = {user_id: [] for user_id in user_ids}
+            if not user_ids:
+                return digests
 
-            logger.info(
-                f"Таблица {table_name} экспортирована в {csv_file_path}. Записей: {len(rows)}"
+            placeholders = ",".join("?" * len(user_ids))
+            cursor = await db.execute(
+                f"""
+                SELECT user_id, asset_ticker, asset_name, is_new, epoch_from, epoch_to,
+                    tvl_change, cap_change, filled, events
+                FROM digest_entries 
+                WHERE user_id IN ({placeholders})
+                ORDER BY user_id, asset_ticker
+            """,
+                user_ids,
             )
-            return len(rows)
+            for row in await cursor.fetchall():
+                digests[row[0]].append(row[1:])
+            return digests
     except Exception as e:
-        logger.error(f"Ошибка при экспорте таблицы {table_name}: {e}", exc_info=True)
+        logger.error(f"Ошибка при получении дайджестов: {e}", exc_info=True)
         raise
 
 
-async def get_bot_statistics():
-    """Получение статистики по боту"""
+async def complete_digests(user_ids, outbox_rows) -> int:
+    """Перенос дайджестов в очередь уведомлений одной транзакцией:
+    добавляет сообщения, удаляет накопленные события и сбрасывает время отправки
+    outbox_rows - кортежи (user_id, notification_type, asset_ticker, message, priority)"""
+    user_ids = list(user_ids)
+    outbox_rows = list(outbox_rows)
+    if not user_ids:
+        return 0
+
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                """
+                INSERT INTO notification_outbox (user_id, notification_type, asset_ticker, message, priority)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                outbox_rows,
+            )
+            params = [(user_id,) for user_id in user_ids]
+            await db.executemany("DELETE FROM digest_entries WHERE user_id = ?", params)
+            await db.executemany(
+                "UPDATE digest_settings SET due_at = NULL WHERE user_id = ?", params
+            )
+            return len(outbox_rows)
+    except Exception as e:
+        logger.error(
+            f"Ошибка при переносе {len(user_ids)} дайджестов в очередь: {e}",
+            exc_info=True,
+        )
+        raise
+
+
+async def add_snapshot(taken_at: float, is_keyframe: bool, rows: list[tuple]) -> int:
+    """
+    Запись снимка активов одной транзакцией.
+    rows - список (asset_ticker, fields, removed_fields, is_deleted)
+
+    Returns:
+        int - snapshot_id
+    """
+    try:
+        async with transaction() as db:
+            cursor = await db.execute(
+                "INSERT INTO snapshots (taken_at, is_keyframe) VALUES (?, ?)",
+                (taken_at, 1 if is_keyframe else 0),
+            )
+            snapshot_id = cursor.lastrowid
+            await db.executemany(
+                """
+                INSERT INTO snapshot_assets
+                    (snapshot_id, asset_ticker, fields, removed_fields, is_deleted)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                [(snapshot_id, *row) for row in rows],
+            )
+            return snapshot_id
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении снимка активов: {e}", exc_info=True)
+        raise
+
+
+async def get_snapshot_chain(taken_before: float = None):
+    """
+    Ключевой кадр и дельты после него до последнего снимка
+    (или до последнего снимка не позже taken_before).
+
+    Returns:
+        dict - snapshot_id, taken_at, deltas (количество дельт после кадра),
+        rows (snapshot_id, is_keyframe, asset_ticker, fields, removed_fields,
+        is_deleted) по порядку; None, если снимков нет
+    """
     try:
-        async with aiosqlite.connect(DB_FILE) as db:
-            # Количество пользователей
-            cursor = await db.execute("SELECT COUNT(*) FROM users")
-            total_users = (await cursor.fetchone())[0]
+        async with read_connection() as db:
+            if taken_before is None:
+                cursor = await db.execute(
+                    "SELECT snapshot_id, taken_at FROM snapshots "
+                    "ORDER BY snapshot_id DESC LIMIT 1"
+                )
+            else:
+                cursor = await db.execute(
+                    "SELECT snapshot_id, taken_at FROM snapshots WHERE taken_at <= ? "
+                    "ORDER BY taken_at DESC, snapshot_id DESC LIMIT 1",
+                    (taken_before,),
+                )
+            target = await cursor.fetchone()
+            if target is None:
+                return None
+            snapshot_id, taken_at = target
 
-            # Количество активных подписок
-            cursor = await db.execute("SELECT COUNT(*) FROM user_subscriptions")
-            total_subscriptions = (await cursor.fetchone())[0]
+            cursor = await db.execute(
+                """
+                SELECT MAX(snapshot_id) FROM snapshots
+                WHERE is_keyframe = 1 AND snapshot_id <= ?
+            """,
+                (snapshot_id,),
+            )
+            keyframe_id = (await cursor.fetchone())[0]
+            if keyframe_id is None:
+                return None
 
-            # Количество уникальных активов с подписками
             cursor = await db.execute(
-                "SELECT COUNT(DISTINCT asset_ticker) FROM user_subscriptions"
+                "SELECT COUNT(*) FROM snapshots WHERE snapshot_id > ? AND snapshot_id <= ?",
+                (keyframe_id, snapshot_id),
             )
-            unique_assets = (await cursor.fetchone())[0]
+            deltas = (await cursor.fetchone())[0]
 
-            # Пользователи с подписками
             cursor = await db.execute(
-                "SELECT COUNT(DISTINCT user_id) FROM user_subscriptions"
+                """
+                SELECT sa.snapshot_id, s.is_keyframe, sa.asset_ticker,
+                       sa.fields, sa.removed_fields, sa.is_deleted
+                FROM snapshot_assets sa
+                JOIN snapshots s ON s.snapshot_id = sa.snapshot_id
+                WHERE sa.snapshot_id BETWEEN ? AND ?
+                ORDER BY sa.snapshot_id
+            """,
+                (keyframe_id, snapshot_id),
             )
-            users_with_subscriptions = (await cursor.fetchone())[0]
+            rows = await cursor.fetchall()
+            return {
+                "snapshot_id": snapshot_id,
+                "taken_at": taken_at,
+                "deltas": deltas,
+                "rows": rows,
+            }
+    except Exception as e:
+        logger.error(f"Ошибка при чтении истории снимков: {e}", exc_info=True)
+        raise
+
+
+# Выгрузка таблиц, в которых данные хранятся по ссылкам на справочники
+EXPORT_QUERIES = {
+    "user_subscriptions": """
+        SELECT s.user_id, a.asset_ticker, a.asset_name, s.created_at
+        FROM user_subscriptions s
+        JOIN assets a ON a.asset_id = s.asset_id
+        ORDER BY s.user_id, a.asset_ticker
+    """,
+}
+
+
+async def iter_table_rows(table_name: str, chunk_size: int):
+    """
+    Потоковое чтение таблицы для экспорта курсором пачками по chunk_size строк.
+    Первой выдается строка с названиями колонок, затем списки строк;
+    в памяти одновременно только одна пачка.
+
+    Чтение идет через отдельное соединение: открытый курсор удерживает
+    снимок данных своего соединения до конца выгрузки, и на общем
+    соединении чтения остальные запросы видели бы устаревшие данные.
+    """
+    query = EXPORT_QUERIES.get(table_name, f"SELECT * FROM {table_name}")
+    db = await _open_connection()
+    try:
+        async with db.execute(query) as cursor:
+            # Названия колонок из результата запроса
+            yield [column[0] for column in cursor.description]
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+    finally:
+        await db.close()
+
+
+async def get_bot_statistics():
+    """
+    Получение статистики по боту.
+    Значения читаются из счетчиков, которые поддерживают триггеры БД,
+    топ активов - по индексу на числе подписчиков.
+    """
+    try:
+        async with read_connection() as db:
+            cursor = await db.execute("SELECT name, value FROM stat_counters")
+            counters = dict(await cursor.fetchall())
 
             # Топ активов по подпискам
             cursor = await db.execute("""
-                SELECT asset_ticker, asset_name, COUNT(*) as count 
-                FROM user_subscriptions 
-                GROUP BY asset_ticker, asset_name 
-                ORDER BY count DESC 
+                SELECT asset_ticker, asset_name, subscribers
+                FROM assets
+                WHERE subscribers > 0
+                ORDER BY subscribers DESC
                 LIMIT 5
             """)
             top_assets = await cursor.fetchall()
 
-            return {
-                "total_users": total_users,
-                "total_subscriptions": total_subscriptions,
-                "unique_assets": unique_assets,
-                "users_with_subscriptions": users_with_subscriptions,
-                "top_assets": top_assets,
-            }
+            stats = {name: counters.get(name, 0) for name in STAT_COUNTERS}
+            stats["top_assets"] = top_assets
+            return stats
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {e}", exc_info=True)
         raise
+
+
+async def reconcile_statistics() -> dict:
+    """
+    Пересчет счетчиков статистики с нуля.
+
+    Returns:
+        dict - общие счетчики, которые разошлись с данными: name -> (было, стало)
+    """
+    try:
+        async with transaction() as db:
+            cursor = await db.execute("SELECT name, value FROM stat_counters")
+            before = dict(await cursor.fetchall())
+            cursor = await db.execute("SELECT asset_id, subscribers FROM assets")
+            assets_before = dict(await cursor.fetchall())
+
+            await rebuild_statistics(db)
+
+            cursor = await db.execute("SELECT name, value FROM stat_counters")
+            after = dict(await cursor.fetchall())
+            cursor = await db.execute("SELECT asset_id, subscribers FROM assets")
+            assets_after = dict(await cursor.fetchall())
+
+        drift = {
+            name: (before.get(name), value)
+            for name, value in after.items()
+            if before.get(name) != value
+        }
+        assets_drift = sum(
+            1
+            for asset_id, value in assets_after.items()
+            if assets_before.get(asset_id) != value
+        )
+        if drift or assets_drift:
+            logger.warning(
+                f"Счетчики статистики пересчитаны, расхождения: {drift}, "
+                f"активов с неверным числом подписчиков: {assets_drift}"
+            )
+        return drift
+    except Exception as e:
+        logger.error(f"Ошибка при пересчете статистики: {e}", exc_info=True)
+        raise
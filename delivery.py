@@ -0,0 +1,533 @@
+"""Параллельная отправка сообщений с ограничением скорости (token bucket)."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+import aiohttp
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import (
+    SEND_BURST_PER_CHAT,
+    SEND_CONCURRENCY,
+    SEND_MAX_RETRIES,
+    SEND_QUEUE_SIZE,
+    SEND_RATE_GLOBAL,
+    SEND_RATE_MIN,
+    SEND_RATE_PER_CHAT,
+    SEND_RETRY_BASE_DELAY,
+    SEND_RETRY_MAX_DELAY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько бакетов чатов держать до очистки неактивных
+CHAT_BUCKETS_PRUNE_THRESHOLD = 10000
+# Во сколько раз снижается общий лимит при RetryAfter
+RATE_DECREASE_FACTOR = 0.5
+# Минимальный интервал между снижениями лимита (серия 429 от параллельных отправок)
+RATE_DECREASE_COOLDOWN = 1.0
+# На сколько сообщений в секунду лимит восстанавливается после каждой успешной отправки
+RATE_RECOVERY_STEP = 0.05
+
+# Классы приоритета: меньше число - выше приоритет
+PRIORITY_REALTIME = 0  # Уведомления подписчикам (эпоха, емкость)
+PRIORITY_ANNOUNCE = 1  # Анонсы новых активов всем пользователям
+PRIORITY_BROADCAST = 2  # Рассылки админа
+PRIORITY_NAMES = {
+    PRIORITY_REALTIME: "realtime",
+    PRIORITY_ANNOUNCE: "announce",
+    PRIORITY_BROADCAST: "broadcast",
+}
+# Сколько воркеров берут только уведомления реального времени
+REALTIME_RESERVED_WORKERS = 2
+
+# Временные ошибки: сообщение стоит отправить повторно
+RETRYABLE_ERRORS = (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Временная ошибка (RetryAfter, сеть, 5xx), а не постоянная (Forbidden, чат не найден)"""
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class TokenBucket:
+    """Ограничитель скорости: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self):
+        """Пополнение токенов за прошедшее время"""
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def is_full(self) -> bool:
+        """Бакет полностью восстановился (чат давно не получал сообщений)"""
+        self._refill()
+        return self._tokens >= self.capacity and time.monotonic() >= self._paused_until
+
+    def pause(self, seconds: float):
+        """Запрет выдачи токенов на указанное время (ответ RetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def _try_take(self) -> float:
+        """
+        Попытка списать токен.
+
+        Returns:
+            float - 0, если токен списан, иначе сколько секунд подождать
+        """
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            return pause
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        """Ожидание и списание одного токена"""
+        while (delay := self._try_take()) > 0:
+            await asyncio.sleep(delay)
+
+
+class PriorityTokenBucket(TokenBucket):
+    """
+    Бакет, выдающий токены в порядке приоритета ожидающих.
+    Токен получает только ожидающий с наивысшим приоритетом (при равном - первый).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self._waiters: list = []
+        self._waiters_seq = itertools.count()
+
+    async def acquire(self, priority: int = PRIORITY_REALTIME):
+        """Ожидание и списание одного токена с учетом приоритета"""
+        entry = [priority, next(self._waiters_seq), asyncio.Event()]
+        heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                if self._waiters[0] is not entry:
+                    # Не наша очередь: ждем, пока нас не разбудит предыдущий
+                    entry[2].clear()
+                    await entry[2].wait()
+                    continue
+                delay = self._try_take()
+                if delay == 0:
+                    return
+                await asyncio.sleep(delay)
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            if self._waiters:
+                self._waiters[0][2].set()
+
+
+class _Job:
+    """Одна отправка в очереди движка"""
+
+    __slots__ = (
+        "chat_id",
+        "send",
+        "future",
+        "priority",
+        "attempt",
+        "enqueued_at",
+        "holds_slot",
+    )
+
+    def __init__(self, chat_id: int, send: Callable, future, priority: int):
+        self.chat_id = chat_id
+        self.send = send
+        self.future = future
+        self.priority = priority
+        self.attempt = 0
+        self.enqueued_at = 0.0
+        # Занимает ли задание место в очереди класса (повторы - нет)
+        self.holds_slot = False
+
+
+class DeliveryEngine:
+    """
+    Пул воркеров для отправки сообщений.
+
+    Каждая отправка ждет токен своего чата и токен общего бакета бота,
+    одновременно выполняется не больше concurrency отправок. Временные
+    ошибки уходят в очередь повторов с задержкой (retry_after от сервера
+    или экспоненциальной), RetryAfter дополнительно снижает общий лимит.
+
+    У каждого класса приоритета своя ограниченная очередь. Воркеры берут
+    задания по приоритету, общий токен тоже достается первым заданиям
+    реального времени, а часть воркеров обслуживает только их - поэтому
+    уведомления подписчикам не ждут за большой рассылкой.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        per_chat_rate: float,
+        per_chat_burst: float,
+        concurrency: int,
+        queue_size: int,
+        max_retries: int = SEND_MAX_RETRIES,
+        min_rate: float = SEND_RATE_MIN,
+    ):
+        self._max_rate = global_rate
+        self._min_rate = min(min_rate, global_rate)
+        self._global_bucket = PriorityTokenBucket(global_rate, global_rate)
+        self._last_rate_decrease = 0.0
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._concurrency = concurrency
+        self._max_retries = max_retries
+        # Очередь и лимит места на каждый класс приоритета
+        self._queues: dict[int, deque] = {
+            priority: deque() for priority in PRIORITY_NAMES
+        }
+        self._space = {
+            priority: asyncio.Semaphore(queue_size) for priority in PRIORITY_NAMES
+        }
+        self._jobs_available = asyncio.Condition()
+        self._workers: list[asyncio.Task] = []
+        # Отложенные повторы: куча (время, порядковый номер, задание)
+        self._delayed: list = []
+        self._delayed_seq = itertools.count()
+        self._delayed_event = asyncio.Event()
+        self._retry_task: asyncio.Task | None = None
+        self._metrics = {
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "retry_after": 0,
+            "retry_delay_total": 0.0,
+            "retry_delay_max": 0.0,
+            "gave_up": 0,
+        }
+        # Время ожидания в очереди по классам приоритета
+        self._class_metrics = {
+            priority: {"started": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    def start(self):
+        """Запуск воркеров (повторный вызов ничего не делает)"""
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self._concurrency)
+        ]
+        self._retry_task = asyncio.create_task(self._retry_scheduler())
+        logger.info(f"Движок отправки запущен. Воркеров: {self._concurrency}")
+
+    async def stop(self):
+        """Остановка воркеров"""
+        tasks = self._workers + ([self._retry_task] if self._retry_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._retry_task = None
+        logger.info("Движок отправки остановлен")
+
+    def metrics(self) -> dict:
+        """Снимок метрик отправки: счетчики, повторы, лимит, очереди по классам"""
+        classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            stats = self._class_metrics[priority]
+            started = stats["started"]
+            classes[name] = {
+                "depth": len(self._queues[priority]),
+                "started": started,
+                "wait_avg": stats["wait_total"] / started if started else 0.0,
+                "wait_max": stats["wait_max"],
+            }
+        return {
+            **self._metrics,
+            "global_rate": round(self._global_bucket.rate, 2),
+            "queue_size": sum(len(queue) for queue in self._queues.values()),
+            "delayed": len(self._delayed),
+            "classes": classes,
+        }
+
+    async def submit(
+        self,
+        chat_id: int,
+        send: Callable[[], Awaitable],
+        priority: int = PRIORITY_REALTIME,
+    ) -> asyncio.Future:
+        """
+        Поставить отправку в очередь.
+        Ждет, если очередь класса заполнена (обратное давление для больших рассылок).
+
+        Args:
+            chat_id: ID чата получателя
+            send: Функция без аргументов, возвращающая корутину отправки
+                (может вызываться повторно при временных ошибках)
+            priority: Класс приоритета (PRIORITY_*)
+
+        Returns:
+            asyncio.Future - результат отправки или исключение
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._enqueue(_Job(chat_id, send, future, priority))
+        return future
+
+    async def _enqueue(self, job: _Job):
+        """Добавление задания в очередь его класса"""
+        await self._space[job.priority].acquire()
+        job.holds_slot = True
+        await self._append(job)
+
+    async def _append(self, job: _Job):
+        """Постановка задания в конец очереди без ожидания места"""
+        job.enqueued_at = time.monotonic()
+        async with self._jobs_available:
+            self._queues[job.priority].append(job)
+            self._jobs_available.notify_all()
+
+    async def _next_job(self, realtime_only: bool) -> _Job:
+        """Ожидание следующего задания с наивысшим приоритетом"""
+        priorities = [PRIORITY_REALTIME] if realtime_only else sorted(self._queues)
+        async with self._jobs_available:
+            await self._jobs_available.wait_for(
+                lambda: any(self._queues[priority] for priority in priorities)
+            )
+            for priority in priorities:
+                if self._queues[priority]:
+                    job = self._queues[priority].popleft()
+                    if job.holds_slot:
+                        job.holds_slot = False
+                        self._space[priority].release()
+                    return job
+
+    async def deliver(
+        self,
+        jobs,
+        on_result: Callable[[int, Exception | None], None] | None = None,
+        priority: int = PRIORITY_REALTIME,
+    ) -> tuple[int, int]:
+        """
+        Отправка набора сообщений с ожиданием завершения.
+
+        Args:
+            jobs: Итерируемый (в т.ч. асинхронно) набор пар (chat_id, send)
+            on_result: Вызывается для каждой отправки с (chat_id, ошибка или None)
+            priority: Класс приоритета всех сообщений набора (PRIORITY_*)
+
+        Returns:
+            tuple - (успешно, ошибок)
+        """
+        counts = {"sent": 0, "failed": 0}
+        pending: set[asyncio.Future] = set()
+
+        def done(chat_id: int, future: asyncio.Future):
+            pending.discard(future)
+            if future.cancelled():
+                return
+            error = future.exception()
+            counts["failed" if error else "sent"] += 1
+            if on_result is not None:
+                try:
+                    on_result(chat_id, error)
+                except Exception as e:
+                    logger.error(f"Ошибка в обработчике результата отправки: {e}")
+
+        async def submit(chat_id: int, send: Callable[[], Awaitable]):
+            future = await self.submit(chat_id, send, priority)
+            pending.add(future)
+            future.add_done_callback(lambda f, chat_id=chat_id: done(chat_id, f))
+
+        try:
+            if hasattr(jobs, "__aiter__"):
+                async for chat_id, send in jobs:
+                    await submit(chat_id, send)
+            else:
+                for chat_id, send in jobs:
+                    await submit(chat_id, send)
+            if pending:
+                await asyncio.wait(set(pending))
+        except asyncio.CancelledError:
+            # Отменяем еще не отправленные сообщения этого набора
+            for future in list(pending):
+                future.cancel()
+            raise
+
+        return counts["sent"], counts["failed"]
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Бакет чата (создается при первой отправке)"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= CHAT_BUCKETS_PRUNE_THRESHOLD:
+                self._prune_chat_buckets()
+            bucket = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self):
+        """Удаление бакетов чатов, которые полностью восстановились"""
+        idle = [
+            chat_id
+            for chat_id, bucket in self._chat_buckets.items()
+            if bucket.is_full()
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+        logger.debug(f"Удалено неактивных бакетов чатов: {len(idle)}")
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """Задержка перед повтором: retry_after от сервера или экспоненциальная"""
+        if isinstance(error, TelegramRetryAfter):
+            return float(error.retry_after)
+        return min(SEND_RETRY_BASE_DELAY * 2**attempt, SEND_RETRY_MAX_DELAY)
+
+    def _on_retry_after(self, chat_id: int, retry_after: float):
+        """Реакция на flood control: пауза чата и снижение общего лимита"""
+        self._chat_bucket(chat_id).pause(retry_after)
+
+        now = time.monotonic()
+        if now - self._last_rate_decrease < RATE_DECREASE_COOLDOWN:
+            return
+        self._last_rate_decrease = now
+        bucket = self._global_bucket
+        new_rate = max(self._min_rate, bucket.rate * RATE_DECREASE_FACTOR)
+        if new_rate < bucket.rate:
+            bucket.rate = new_rate
+            logger.warning(
+                f"Получен RetryAfter ({retry_after} сек) для чата {chat_id}. "
+                f"Общий лимит снижен до {new_rate:.1f} сообщений/сек"
+            )
+
+    def _on_success(self):
+        """Постепенное восстановление общего лимита после снижения"""
+        bucket = self._global_bucket
+        if bucket.rate < self._max_rate:
+            bucket.rate = min(self._max_rate, bucket.rate + RATE_RECOVERY_STEP)
+
+    def _schedule_retry(self, delay: float, job: _Job):
+        """Отложить повтор отправки на delay секунд"""
+        heapq.heappush(
+            self._delayed, (time.monotonic() + delay, next(self._delayed_seq), job)
+        )
+        self._delayed_event.set()
+
+    async def _retry_scheduler(self):
+        """Возврат отложенных повторов в очередь, когда подошло их время"""
+        while True:
+            self._delayed_event.clear()
+            if not self._delayed:
+                await self._delayed_event.wait()
+                continue
+
+            wait = self._delayed[0][0] - time.monotonic()
+            if wait > 0:
+                # Просыпаемся раньше, если появился повтор с меньшей задержкой
+                try:
+                    await asyncio.wait_for(self._delayed_event.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, job = heapq.heappop(self._delayed)
+            if not job.future.done():
+                # Повтор уже был принят в очередь: место не ждем, иначе полная
+                # очередь рассылки задержала бы все следующие повторы
+                await self._append(job)
+
+    async def _worker(self, worker_id: int):
+        """Воркер: берет отправки из очереди с учетом приоритета и лимитов"""
+        realtime_only = worker_id < min(
+            REALTIME_RESERVED_WORKERS, self._concurrency - 1
+        )
+        while True:
+            job = await self._next_job(realtime_only)
+            future = job.future
+            if future.done():
+                continue
+
+            stats = self._class_metrics[job.priority]
+            wait = time.monotonic() - job.enqueued_at
+            stats["started"] += 1
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+
+            # Сначала лимит чата, чтобы не тратить общий токен на ожидание
+            await self._chat_bucket(job.chat_id).acquire()
+            await self._global_bucket.acquire(job.priority)
+            if future.done():
+                continue
+            try:
+                result = await job.send()
+            except Exception as e:
+                self._handle_error(job, e)
+            else:
+                self._metrics["sent"] += 1
+                self._on_success()
+                if not future.done():
+                    future.set_result(result)
+
+    def _handle_error(self, job: _Job, error: Exception):
+        """Повтор временной ошибки или завершение отправки с ошибкой"""
+        chat_id, future, attempt = job.chat_id, job.future, job.attempt
+
+        if isinstance(error, TelegramRetryAfter):
+            self._metrics["retry_after"] += 1
+            self._on_retry_after(chat_id, error.retry_after)
+
+        if is_retryable_error(error) and attempt < self._max_retries:
+            delay = self._retry_delay(error, attempt)
+            self._metrics["retried"] += 1
+            self._metrics["retry_delay_total"] += delay
+            self._metrics["retry_delay_max"] = max(
+                self._metrics["retry_delay_max"], delay
+            )
+            logger.info(
+                f"Временная ошибка отправки в чат {chat_id} ({type(error).__name__}). "
+                f"Повтор {attempt + 1}/{self._max_retries} через {delay:.1f} сек"
+            )
+            job.attempt += 1
+            self._schedule_retry(delay, job)
+            return
+
+        if is_retryable_error(error):
+            self._metrics["gave_up"] += 1
+        self._metrics["failed"] += 1
+        if not future.done():
+            future.set_exception(error)
+
+
+# Общий движок отправки для уведомлений и рассылок
+delivery_engine = DeliveryEngine(
+    global_rate=SEND_RATE_GLOBAL,
+    per_chat_rate=SEND_RATE_PER_CHAT,
+    per_chat_burst=SEND_BURST_PER_CHAT,
+    concurrency=SEND_CONCURRENCY,
+    queue_size=SEND_QUEUE_SIZE,
+)
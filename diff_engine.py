@@ -0,0 +1,254 @@
+"""Однопроходное сравнение снимков активов с подключаемыми правилами."""
+
+import logging
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Ссылка на платформу в конце каждого уведомления
+PIGGYBANK_LINK = '<a href="https://app.piggybank.fi/">Open PiggyBank</a>'
+
+# Кому адресовано событие: всем пользователям или подписчикам актива
+AUDIENCE_ALL = "all"
+AUDIENCE_SUBSCRIBERS = "subscribers"
+
+# Зарегистрированные правила в порядке регистрации
+_rules: list[Callable] = []
+
+
+class AssetState:
+    """Разобранное состояние актива: числа парсятся один раз на проход"""
+
+    __slots__ = (
+        "ticker",
+        "name",
+        "has_epoch",
+        "epoch",
+        "tvl",
+        "cap",
+        "tvl_invalid",
+        "cap_invalid",
+        "filled",
+    )
+
+    def __init__(self, ticker: str, asset: dict, fill_note: str = ""):
+        self.ticker = ticker
+        self.name = asset.get("asset_name", ticker)
+        self.has_epoch = "epoch" in asset
+        self.epoch = asset.get("epoch")
+        self.tvl, self.tvl_invalid = _parse_float(asset.get("lst_tvl"))
+        self.cap, self.cap_invalid = _parse_float(asset.get("lst_cap"))
+
+        # Строка "сколько заполнено из скольки" одна на все правила
+        self.filled = ""
+        if self.tvl is not None and self.cap is not None:
+            try:
+                self.filled = f"\nFilled: {int(self.tvl):,} / {int(self.cap):,}"
+            except (ValueError, OverflowError):
+                pass
+        # Дополнение к строке заполнения (например, прогноз до лимита)
+        if self.filled and fill_note:
+            self.filled += fill_note
+
+
+def _parse_float(value) -> tuple[float | None, bool]:
+    """
+    Преобразование значения в float.
+
+    Returns:
+        tuple - (число или None, True если значение есть, но не число)
+    """
+    if value is None:
+        return None, False
+    try:
+        return float(value), False
+    except (ValueError, TypeError):
+        return None, True
+
+
+def change_rule(func: Callable) -> Callable:
+    """
+    Регистрация правила изменения.
+
+    Правило вызывается как rule(old, new), где old - AssetState или None
+    (актива не было в сохраненных данных), new - AssetState. Возвращает
+    событие (dict) или None, если уведомлять не о чем.
+    """
+    _rules.append(func)
+    return func
+
+
+def get_rules() -> list[Callable]:
+    """Список зарегистрированных правил"""
+    return list(_rules)
+
+
+def index_by_ticker(assets: list) -> dict:
+    """Словарь активов по тикеру (только валидные непустые строки)"""
+    return {
+        asset.get("asset_ticker"): asset
+        for asset in assets
+        if asset.get("asset_ticker") and isinstance(asset.get("asset_ticker"), str)
+    }
+
+
+def diff_assets(
+    saved_assets: list,
+    current_assets: list,
+    rules=None,
+    fill_note: Callable[[str], str] | None = None,
+) -> list[dict]:
+    """
+    Сравнение сохраненного и текущего снимков за один проход.
+
+    Неизменившиеся активы пропускаются без разбора. События группируются
+    по правилам в порядке их регистрации.
+
+    Args:
+        saved_assets: Сохраненный список активов
+        current_assets: Текущий список активов
+        rules: Список правил (по умолчанию все зарегистрированные)
+        fill_note: Функция ticker -> текст, добавляемый к строке заполнения
+            нового состояния (вызывается только для изменившихся активов)
+
+    Returns:
+        list - события с ключами type, asset_ticker, asset_name, audience, message
+    """
+    rules = _rules if rules is None else rules
+    saved_dict = index_by_ticker(saved_assets)
+    current_dict = index_by_ticker(current_assets)
+
+    logger.debug(
+        f"Сравнение: сохранено {len(saved_dict)} активов, текущих {len(current_dict)} активов"
+    )
+
+    events_by_rule = [[] for _ in rules]
+    for ticker, current_asset in current_dict.items():
+        saved_asset = saved_dict.get(ticker)
+        if saved_asset == current_asset:
+            continue
+
+        new = AssetState(ticker, current_asset, fill_note(ticker) if fill_note else "")
+        old = AssetState(ticker, saved_asset) if saved_asset else None
+        for events, rule in zip(events_by_rule, rules):
+            event = rule(old, new)
+            if event is not None:
+                events.append(event)
+
+    return [event for events in events_by_rule for event in events]
+
+
+def format_change(change: float) -> str:
+    """Изменение с точностью до сотых и знаком + или -"""
+    return f"{change:+.2f}" if change != 0 else "0.00"
+
+
+@change_rule
+def epoch_appeared(old: AssetState | None, new: AssetState) -> dict | None:
+    """Появление ключа epoch (новый актив или у существующего)"""
+    if not new.has_epoch or (old is not None and old.has_epoch):
+        return None
+
+    logger.info(f"Обнаружено появление epoch для актива {new.name} ({new.ticker})")
+    return {
+        "type": "epoch_appeared",
+        "asset_ticker": new.ticker,
+        "asset_name": new.name,
+        "audience": AUDIENCE_ALL,
+        "new_epoch": new.epoch,
+        "filled": new.filled,
+        "message": f"🆕 New asset added <b>{new.name}</b>!{new.filled}\n\nUse /start to configure notifications for this asset.\n\n{PIGGYBANK_LINK}",
+    }
+
+
+@change_rule
+def epoch_changed(old: AssetState | None, new: AssetState) -> dict | None:
+    """Изменение номера эпохи"""
+    if old is None or not (old.has_epoch and new.has_epoch):
+        return None
+    if new.epoch == old.epoch:
+        return None
+
+    logger.info(
+        f"Обнаружено изменение epoch для {new.name} ({new.ticker}): {old.epoch} → {new.epoch}"
+    )
+    return {
+        "type": "epoch_changed",
+        "asset_ticker": new.ticker,
+        "asset_name": new.name,
+        "audience": AUDIENCE_SUBSCRIBERS,
+        "old_epoch": old.epoch,
+        "new_epoch": new.epoch,
+        "filled": new.filled,
+        "message": f"🆕✨🔄 <b>NEW EPOCH!</b> ✨🆕\n\n<b>{new.name}</b>\nEpoch: {old.epoch} → {new.epoch}{new.filled}\n\n{PIGGYBANK_LINK}",
+    }
+
+
+@change_rule
+def lst_tvl_changed(old: AssetState | None, new: AssetState) -> dict | None:
+    """Изменение lst_tvl больше чем на 1 (появление значения не отслеживается)"""
+    if old is None:
+        return None
+    # Сравниваем только если значение есть в обоих снимках
+    if (old.tvl is None and not old.tvl_invalid) or (
+        new.tvl is None and not new.tvl_invalid
+    ):
+        return None
+    if old.tvl_invalid or new.tvl_invalid:
+        logger.warning(f"Ошибка при преобразовании значений lst_tvl для {new.ticker}")
+        return None
+
+    change = new.tvl - old.tvl
+    if not abs(change) > 1.0:
+        return None
+
+    logger.info(
+        f"Изменение lst_tvl для {new.name} ({new.ticker}): {old.tvl} → {new.tvl} ({change:+})"
+    )
+    # Выбираем эмодзи в зависимости от направления изменения
+    change_emoji = "📈" if change > 0 else "📉"
+    return {
+        "type": "lst_tvl_changed",
+        "asset_ticker": new.ticker,
+        "asset_name": new.name,
+        "audience": AUDIENCE_SUBSCRIBERS,
+        "old_value": old.tvl,
+        "new_value": new.tvl,
+        "change": change,
+        "filled": new.filled,
+        "message": f"{change_emoji} <b>Capacity changed</b>\n\nAsset: <b>{new.name}</b> ({new.ticker})\nChange: {format_change(change)}{new.filled}\n\n{PIGGYBANK_LINK}",
+    }
+
+
+@change_rule
+def lst_cap_changed(old: AssetState | None, new: AssetState) -> dict | None:
+    """Любое изменение lst_cap (не только больше 1)"""
+    if old is None:
+        return None
+    # Сравниваем только если значение есть в обоих снимках
+    if (old.cap is None and not old.cap_invalid) or (
+        new.cap is None and not new.cap_invalid
+    ):
+        return None
+    if old.cap_invalid or new.cap_invalid:
+        logger.warning(f"Ошибка при преобразовании значений lst_cap для {new.ticker}")
+        return None
+
+    change = new.cap - old.cap
+    if not abs(change) > 0:
+        return None
+
+    logger.info(
+        f"Изменение lst_cap для {new.name} ({new.ticker}): {old.cap} → {new.cap} ({change:+})"
+    )
+    return {
+        "type": "lst_cap_changed",
+        "asset_ticker": new.ticker,
+        "asset_name": new.name,
+        "audience": AUDIENCE_SUBSCRIBERS,
+        "old_value": old.cap,
+        "new_value": new.cap,
+        "change": change,
+        "filled": new.filled,
+        "message": f"⚡️🔧⚡️ <b>CAPACITY LIMIT CHANGED</b> ⚡️🔧⚡️\n\n<b>{new.name}</b> ({new.ticker})\nChange: {format_change(change)}{new.filled}\n\n{PIGGYBANK_LINK}",
+    }
@@ -0,0 +1,178 @@
+"""Режим дайджеста: события копятся в SQLite и отправляются одним сообщением по расписанию."""
+
+import asyncio
+import logging
+import time
+
+from coalescing import pack_parts
+from config import DIGEST_BATCH_SIZE, DIGEST_CHECK_INTERVAL
+from database import (
+    add_digest_events,
+    complete_digests,
+    get_due_digests,
+)
+from delivery import PRIORITY_ANNOUNCE
+from diff_engine import format_change
+from outbox import wake_outbox
+
+logger = logging.getLogger(__name__)
+
+# Доступные интервалы дайджеста: аргумент команды /digest -> секунды
+DIGEST_INTERVALS = {
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "4h": 4 * 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# Добавление событий и отправка дайджестов не должны пересекаться:
+# иначе событие, добавленное во время отправки, будет удалено неотправленным
+_digest_lock = asyncio.Lock()
+
+
+def interval_label(interval_seconds: int) -> str:
+    """Название интервала для пользователя ("15m", "1h", ...)"""
+    for label, seconds in DIGEST_INTERVALS.items():
+        if seconds == interval_seconds:
+            return label
+    return f"{interval_seconds}s"
+
+
+def split_digest(
+    notifications: list[dict], digest_users: set[int]
+) -> tuple[list[dict], list[tuple]]:
+    """
+    Разделение получателей уведомлений на обычных и пользователей дайджеста.
+
+    Args:
+        notifications: Уведомления с ключами type, asset_ticker, asset_name, users
+        digest_users: Пользователи в режиме дайджеста (get_digest_user_ids)
+
+    Returns:
+        tuple - (уведомления только для обычных получателей,
+                 строки для add_digest_events)
+    """
+    if not notifications or not digest_users:
+        return notifications, []
+
+    realtime = []
+    digest_rows = []
+    for notification in notifications:
+        users = []
+        event_row = _event_fields(notification)
+        for user_id in notification.get("users", []):
+            if user_id in digest_users:
+                digest_rows.append((user_id, *event_row))
+            else:
+                users.append(user_id)
+        if users:
+            realtime.append({**notification, "users": users})
+
+    return realtime, digest_rows
+
+
+def _event_fields(notification: dict) -> tuple:
+    """Поля события для строки дайджеста (без user_id)"""
+    event_type = notification.get("type")
+    is_new = 1 if event_type == "epoch_appeared" else 0
+    epoch_from = notification.get("old_epoch")
+    epoch_to = notification.get("new_epoch")
+    tvl_change = notification.get("change", 0) if event_type == "lst_tvl_changed" else 0
+    cap_change = notification.get("change", 0) if event_type == "lst_cap_changed" else 0
+    return (
+        notification.get("asset_ticker"),
+        notification.get("asset_name"),
+        is_new,
+        epoch_from,
+        epoch_to,
+        tvl_change,
+        cap_change,
+        notification.get("filled", ""),
+    )
+
+
+async def add_events(digest_rows: list[tuple]) -> int:
+    """Сохранение событий в дайджест (объединяются с уже накопленными)"""
+    if not digest_rows:
+        return 0
+    async with _digest_lock:
+        added = await add_digest_events(digest_rows, time.time())
+    logger.info(f"В дайджест добавлено событий: {added}")
+    return added
+
+
+def _render_entry(entry: tuple) -> str:
+    """Текст одного актива в дайджесте"""
+    (
+        ticker,
+        name,
+        is_new,
+        epoch_from,
+        epoch_to,
+        tvl_change,
+        cap_change,
+        filled,
+        events,
+    ) = entry
+
+    lines = [f"<b>{name or ticker}</b> ({ticker})"]
+    if is_new:
+        lines.append("🆕 New asset added")
+    if epoch_from is not None and epoch_to is not None and epoch_from != epoch_to:
+        lines.append(f"🔄 Epoch: {epoch_from} → {epoch_to}")
+    if tvl_change:
+        change_emoji = "📈" if tvl_change > 0 else "📉"
+        lines.append(f"{change_emoji} Capacity: {format_change(tvl_change)}")
+    if cap_change:
+        lines.append(f"🔧 Capacity limit: {format_change(cap_change)}")
+    if filled:
+        lines.append(filled.strip())
+    if events > 1:
+        lines.append(f"<i>Updates: {events}</i>")
+    return "\n".join(lines)
+
+
+def render_digest(entries: list[tuple]) -> list[str]:
+    """Сообщения дайджеста (несколько, если не помещаются в лимит Telegram)"""
+    header = f"🗞 <b>Digest</b>\n\nAssets updated: {len(entries)}"
+    parts = [header] + [_render_entry(entry) for entry in entries]
+    return pack_parts(parts, separator="\n\n")
+
+
+async def flush_due_digests() -> int:
+    """
+    Перенос наступивших дайджестов в очередь уведомлений.
+    Читаются только события пользователей, у которых наступило время отправки.
+
+    Returns:
+        int - количество добавленных в очередь сообщений
+    """
+    total = 0
+    while True:
+        async with _digest_lock:
+            digests = await get_due_digests(time.time(), DIGEST_BATCH_SIZE)
+            if not digests:
+                break
+
+            outbox_rows = [
+                (user_id, "digest", None, message, PRIORITY_ANNOUNCE)
+                for user_id, entries in digests.items()
+                if entries
+                for message in render_digest(entries)
+            ]
+            total += await complete_digests(digests.keys(), outbox_rows)
+    return total
+
+
+async def digest_worker():
+    """Фоновая отправка дайджестов по расписанию (продолжается после перезапуска)"""
+    logger.info("Отправитель дайджестов запущен")
+    while True:
+        try:
+            queued = await flush_due_digests()
+            if queued:
+                logger.info(f"В очередь добавлено дайджестов: {queued}")
+                wake_outbox()
+        except Exception as e:
+            logger.error(f"Ошибка при отправке дайджестов: {e}", exc_info=True)
+        await asyncio.sleep(DIGEST_CHECK_INTERVAL)
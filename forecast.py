@@ -0,0 +1,153 @@
+"""Онлайн-оценка скорости заполнения активов и прогноз времени до лимита."""
+
+import logging
+import math
+
+from config import FORECAST_HALF_LIFE
+from diff_engine import AssetState, index_by_ticker
+
+logger = logging.getLogger(__name__)
+
+# Минимум значений и разброс их времени (стандартное отклонение, секунды),
+# при которых наклон считается надежным
+MIN_SAMPLES = 3
+MIN_TIME_SPREAD = 60
+# Прогнозы дальше этого срока не показываются
+MAX_ETA = 365 * 24 * 60 * 60
+
+
+class FillRateEstimator:
+    """
+    Экспоненциально взвешенная линейная регрессия TVL по времени.
+
+    Хранятся только взвешенные суммы относительно времени последнего
+    значения, поэтому обновление - O(1) и история не перечитывается.
+    Вес значения уменьшается вдвое каждые half_life секунд.
+    """
+
+    __slots__ = (
+        "half_life",
+        "epoch",
+        "last_time",
+        "last_tvl",
+        "s0",
+        "st",
+        "stt",
+        "sy",
+        "sty",
+    )
+
+    def __init__(self, half_life: float, epoch=None):
+        self.half_life = half_life
+        self.epoch = epoch
+        self.last_time = None
+        self.last_tvl = None
+        # Суммы: веса, w*t, w*t^2, w*y, w*t*y (t отсчитывается от last_time)
+        self.s0 = self.st = self.stt = self.sy = self.sty = 0.0
+
+    def add(self, timestamp: float, tvl: float):
+        """Учет нового значения TVL"""
+        if self.last_time is not None:
+            dt = timestamp - self.last_time
+            if dt < 0:
+                # Часы сдвинулись назад: значение пропускаем
+                return
+            # Перенос начала отсчета времени на новое значение
+            self.stt = self.stt - 2 * dt * self.st + dt * dt * self.s0
+            self.sty = self.sty - dt * self.sy
+            self.st = self.st - dt * self.s0
+            # Затухание старых значений
+            decay = 0.5 ** (dt / self.half_life)
+            self.s0 *= decay
+            self.st *= decay
+            self.stt *= decay
+            self.sy *= decay
+            self.sty *= decay
+
+        self.s0 += 1.0
+        self.sy += tvl
+        self.last_time = timestamp
+        self.last_tvl = tvl
+
+    def rate(self) -> float | None:
+        """Скорость заполнения в единицах TVL в секунду (None, если данных мало)"""
+        if self.s0 < MIN_SAMPLES:
+            return None
+        denominator = self.s0 * self.stt - self.st * self.st
+        if denominator <= (MIN_TIME_SPREAD * self.s0) ** 2:
+            return None
+        return (self.s0 * self.sty - self.st * self.sy) / denominator
+
+    def eta(self, cap: float | None) -> float | None:
+        """Прогноз секунд до достижения лимита (None, если он не ожидается)"""
+        if cap is None or self.last_tvl is None or self.last_tvl >= cap:
+            return None
+        rate = self.rate()
+        if rate is None or rate <= 0:
+            return None
+        seconds = (cap - self.last_tvl) / rate
+        return seconds if seconds <= MAX_ETA else None
+
+
+def format_duration(seconds: float) -> str:
+    """Короткая запись длительности: 45m, 3h 20m, 2d 4h"""
+    minutes = max(1, math.ceil(seconds / 60))
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m" if minutes else f"{hours}h"
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h" if hours else f"{days}d"
+
+
+class FillForecaster:
+    """
+    Оценки скорости заполнения по всем активам, которые обновляет цикл опроса.
+    При смене эпохи оценка актива начинается заново.
+    """
+
+    def __init__(self, half_life: float):
+        self._half_life = half_life
+        self._estimators: dict[str, FillRateEstimator] = {}
+        self._caps: dict[str, float | None] = {}
+        # Увеличивается при каждом обновлении (ключ кэша отображения)
+        self.revision = 0
+
+    def add_snapshot(self, assets: list, timestamp: float):
+        """Учет значений всех активов из снимка API"""
+        for ticker, asset in index_by_ticker(assets).items():
+            state = AssetState(ticker, asset)
+            if state.tvl is None:
+                continue
+            estimator = self._estimators.get(ticker)
+            if estimator is None or estimator.epoch != state.epoch:
+                if estimator is not None:
+                    logger.info(
+                        f"Новая эпоха {state.epoch} у {ticker}: прогноз заполнения сброшен"
+                    )
+                estimator = self._estimators[ticker] = FillRateEstimator(
+                    self._half_life, state.epoch
+                )
+            estimator.add(timestamp, state.tvl)
+            self._caps[ticker] = state.cap
+        self.revision += 1
+
+    def eta(self, ticker: str) -> float | None:
+        """Прогноз секунд до лимита по последним данным"""
+        estimator = self._estimators.get(ticker)
+        if estimator is None:
+            return None
+        return estimator.eta(self._caps.get(ticker))
+
+    def fill_note(self, ticker: str) -> str:
+        """Строка прогноза для сообщений (пустая, если прогноза нет)"""
+        seconds = self.eta(ticker)
+        if seconds is None:
+            return ""
+        rate = self._estimators[ticker].rate() * 3600
+        return f"\nCap ETA: ~{format_duration(seconds)} ({rate:+,.0f}/h)"
+
+
+# Общий прогноз процесса
+forecaster = FillForecaster(FORECAST_HALF_LIFE)
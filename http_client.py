@@ -0,0 +1,62 @@
+"""Общий HTTP клиент с пулом соединений для запросов к API."""
+
+import asyncio
+import logging
+
+import aiohttp
+
+from config import (
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Единственная сессия на процесс (создается лениво при первом запросе)
+_session: aiohttp.ClientSession | None = None
+_session_lock = asyncio.Lock()
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Получить общую HTTP сессию.
+
+    Сессия держит пул keep-alive соединений и кэш DNS, поэтому повторные
+    запросы не платят за новый TCP/TLS хендшейк (и CONNECT через прокси).
+
+    Returns:
+        aiohttp.ClientSession - общая сессия процесса
+    """
+    global _session
+
+    if _session is not None and not _session.closed:
+        return _session
+
+    async with _session_lock:
+        # Повторная проверка: сессию мог создать другой вызов, пока мы ждали
+        if _session is None or _session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_SIZE,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            )
+            _session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            )
+            logger.info(
+                f"HTTP сессия создана (пул: {HTTP_POOL_SIZE}, таймаут: {HTTP_TIMEOUT} сек)"
+            )
+    return _session
+
+
+async def close_session():
+    """Закрытие общей HTTP сессии при остановке бота"""
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("HTTP сессия закрыта")
+    _session = None
@@ -0,0 +1,395 @@
+"""Версионные миграции схемы SQLite (номер версии хранится в PRAGMA user_version)."""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def _ensure_column(db, table_name: str, column_name: str, definition: str):
+    """Добавление колонки в существующую таблицу, если ее еще нет"""
+    cursor = await db.execute(f"PRAGMA table_info({table_name})")
+    columns = {col[1] for col in await cursor.fetchall()}
+    if column_name not in columns:
+        await db.execute(
+            f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"
+        )
+        logger.info(f"В таблицу {table_name} добавлена колонка {column_name}")
+
+
+async def _migration_1_baseline(db):
+    """
+    Схема до введения версий.
+    Базы, созданные раньше, могли не содержать часть таблиц и колонок,
+    поэтому все шаги идемпотентны.
+    """
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            deactivated_at TIMESTAMP,
+            deactivation_reason TEXT
+        )
+    """)
+    # Колонки, добавленные после первой версии схемы
+    await _ensure_column(db, "users", "is_active", "INTEGER NOT NULL DEFAULT 1")
+    await _ensure_column(db, "users", "deactivated_at", "TIMESTAMP")
+    await _ensure_column(db, "users", "deactivation_reason", "TEXT")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            asset_ticker TEXT NOT NULL,
+            asset_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, asset_ticker),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+    # Очередь уведомлений: строки переживают перезапуск до отправки
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            notification_type TEXT,
+            asset_ticker TEXT,
+            message TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    """)
+    await _ensure_column(
+        db, "notification_outbox", "priority", "INTEGER NOT NULL DEFAULT 0"
+    )
+    await db.execute("DROP INDEX IF EXISTS idx_notification_outbox_status")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending
+        ON notification_outbox (status, priority, id)
+    """)
+    # Рассылки админа: задание с курсором по получателям для продолжения
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            photo_file_id TEXT,
+            caption TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            total_users INTEGER NOT NULL DEFAULT 0,
+            successful INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            log_file TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    # Режим дайджеста: интервал и время ближайшей отправки для пользователя
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS digest_settings (
+            user_id INTEGER PRIMARY KEY,
+            interval_seconds INTEGER NOT NULL,
+            due_at REAL
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_digest_settings_due
+        ON digest_settings (due_at)
+    """)
+    # Накопленные события дайджеста: одна строка на (пользователь, актив),
+    # новые события объединяются с ней при добавлении
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS digest_entries (
+            user_id INTEGER NOT NULL,
+            asset_ticker TEXT NOT NULL,
+            asset_name TEXT,
+            is_new INTEGER NOT NULL DEFAULT 0,
+            epoch_from,
+            epoch_to,
+            tvl_change REAL NOT NULL DEFAULT 0,
+            cap_change REAL NOT NULL DEFAULT 0,
+            filled TEXT,
+            events INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, asset_ticker)
+        )
+    """)
+
+
+async def _migration_2_assets(db):
+    """
+    Справочник активов с целочисленными id.
+    Подписки ссылаются на актив по asset_id вместо повторения тикера и
+    названия в каждой строке; индекс (asset_id, user_id) покрывает выборку
+    подписчиков актива без обращения к таблице.
+    """
+    await db.execute("""
+        CREATE TABLE assets (
+            asset_id INTEGER PRIMARY KEY,
+            asset_ticker TEXT NOT NULL UNIQUE,
+            asset_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        INSERT INTO assets (asset_ticker, asset_name)
+        SELECT asset_ticker, MAX(asset_name) FROM user_subscriptions
+        GROUP BY asset_ticker
+        ORDER BY MIN(id)
+    """)
+    # Первичный ключ (user_id, asset_id) без rowid покрывает подписки пользователя
+    await db.execute("""
+        CREATE TABLE user_subscriptions_new (
+            user_id INTEGER NOT NULL,
+            asset_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, asset_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (asset_id) REFERENCES assets(asset_id)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        INSERT OR IGNORE INTO user_subscriptions_new (user_id, asset_id, created_at)
+        SELECT s.user_id, a.asset_id, s.created_at
+        FROM user_subscriptions s
+        JOIN assets a ON a.asset_ticker = s.asset_ticker
+    """)
+    await db.execute("DROP TABLE user_subscriptions")
+    await db.execute("ALTER TABLE user_subscriptions_new RENAME TO user_subscriptions")
+    await db.execute("""
+        CREATE INDEX idx_user_subscriptions_asset
+        ON user_subscriptions (asset_id, user_id)
+    """)
+
+
+# Материализованные счетчики статистики (таблица stat_counters)
+STAT_COUNTERS = (
+    "total_users",
+    "inactive_users",
+    "digest_users",
+    "total_subscriptions",
+    "unique_assets",
+    "users_with_subscriptions",
+)
+
+
+async def rebuild_statistics(db):
+    """
+    Пересчет счетчиков статистики с нуля полными запросами.
+    Вызывается внутри транзакции (миграция или reconcile_statistics).
+    """
+    await db.execute("""
+        UPDATE assets SET subscribers = (
+            SELECT COUNT(*) FROM user_subscriptions s
+            WHERE s.asset_id = assets.asset_id
+        )
+    """)
+    await db.execute("DELETE FROM stat_counters")
+    await db.execute("""
+        INSERT INTO stat_counters (name, value)
+        SELECT 'total_users', COUNT(*) FROM users
+        UNION ALL
+        SELECT 'inactive_users', COUNT(*) FROM users WHERE is_active = 0
+        UNION ALL
+        SELECT 'digest_users', COUNT(*) FROM digest_settings
+        WHERE interval_seconds > 0
+        UNION ALL
+        SELECT 'total_subscriptions', COUNT(*) FROM user_subscriptions
+        UNION ALL
+        SELECT 'unique_assets', COUNT(*) FROM assets WHERE subscribers > 0
+        UNION ALL
+        SELECT 'users_with_subscriptions', COUNT(DISTINCT user_id)
+        FROM user_subscriptions
+    """)
+
+
+async def _migration_3_stat_counters(db):
+    """
+    Счетчики статистики, которые поддерживаются триггерами при каждой записи
+    в users, user_subscriptions и digest_settings. /get_data читает готовые
+    значения вместо COUNT(DISTINCT ...) и GROUP BY по всем подпискам.
+    """
+    await db.execute("""
+        CREATE TABLE stat_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    # Количество подписчиков актива; индекс отдает топ без сортировки
+    await _ensure_column(db, "assets", "subscribers", "INTEGER NOT NULL DEFAULT 0")
+    await db.execute("""
+        CREATE INDEX idx_assets_subscribers ON assets (subscribers)
+    """)
+
+    # Пользователи: upsert в save_users срабатывает как INSERT или UPDATE
+    await db.execute("""
+        CREATE TRIGGER stat_users_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE stat_counters SET value = value + 1 WHERE name = 'total_users';
+            UPDATE stat_counters SET value = value + 1
+            WHERE name = 'inactive_users' AND NEW.is_active = 0;
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER stat_users_active AFTER UPDATE OF is_active ON users
+        WHEN OLD.is_active != NEW.is_active
+        BEGIN
+            UPDATE stat_counters
+            SET value = value + CASE WHEN NEW.is_active = 0 THEN 1 ELSE -1 END
+            WHERE name = 'inactive_users';
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER stat_users_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE stat_counters SET value = value - 1 WHERE name = 'total_users';
+            UPDATE stat_counters SET value = value - 1
+            WHERE name = 'inactive_users' AND OLD.is_active = 0;
+        END
+    """)
+
+    # Подписки: счетчик актива, общие счетчики и переходы 0 <-> 1, которые
+    # проверяются по первичному ключу (user_id, asset_id) и счетчику актива
+    await db.execute("""
+        CREATE TRIGGER stat_subscriptions_insert AFTER INSERT ON user_subscriptions
+        BEGIN
+            UPDATE stat_counters SET value = value + 1
+            WHERE name = 'total_subscriptions';
+            UPDATE stat_counters SET value = value + 1
+            WHERE name = 'unique_assets'
+            AND (SELECT subscribers FROM assets WHERE asset_id = NEW.asset_id) = 0;
+            UPDATE stat_counters SET value = value + 1
+            WHERE name = 'users_with_subscriptions'
+            AND NOT EXISTS (
+                SELECT 1 FROM user_subscriptions
+                WHERE user_id = NEW.user_id AND asset_id != NEW.asset_id
+            );
+            UPDATE assets SET subscribers = subscribers + 1
+            WHERE asset_id = NEW.asset_id;
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER stat_subscriptions_delete AFTER DELETE ON user_subscriptions
+        BEGIN
+            UPDATE stat_counters SET value = value - 1
+            WHERE name = 'total_subscriptions';
+            UPDATE stat_counters SET value = value - 1
+            WHERE name = 'unique_assets'
+            AND (SELECT subscribers FROM assets WHERE asset_id = OLD.asset_id) = 1;
+            UPDATE stat_counters SET value = value - 1
+            WHERE name = 'users_with_subscriptions'
+            AND NOT EXISTS (
+                SELECT 1 FROM user_subscriptions WHERE user_id = OLD.user_id
+            );
+            UPDATE assets SET subscribers = subscribers - 1
+            WHERE asset_id = OLD.asset_id;
+        END
+    """)
+
+    # Дайджест: учитываются только пользователи с включенным интервалом
+    await db.execute("""
+        CREATE TRIGGER stat_digest_insert AFTER INSERT ON digest_settings
+        WHEN NEW.interval_seconds > 0
+        BEGIN
+            UPDATE stat_counters SET value = value + 1 WHERE name = 'digest_users';
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER stat_digest_update AFTER UPDATE OF interval_seconds
+        ON digest_settings
+        WHEN (OLD.interval_seconds > 0) != (NEW.interval_seconds > 0)
+        BEGIN
+            UPDATE stat_counters
+            SET value = value + CASE WHEN NEW.interval_seconds > 0 THEN 1 ELSE -1 END
+            WHERE name = 'digest_users';
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER stat_digest_delete AFTER DELETE ON digest_settings
+        WHEN OLD.interval_seconds > 0
+        BEGIN
+            UPDATE stat_counters SET value = value - 1 WHERE name = 'digest_users';
+        END
+    """)
+
+    await rebuild_statistics(db)
+
+
+async def _migration_4_snapshots(db):
+    """
+    История снимков активов: ключевые кадры с полными данными и между ними
+    дельты - только изменившиеся поля изменившихся активов.
+    """
+    await db.execute("""
+        CREATE TABLE snapshots (
+            snapshot_id INTEGER PRIMARY KEY,
+            taken_at REAL NOT NULL,
+            is_keyframe INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Поиск ближайшего ключевого кадра и снимка на момент времени
+    await db.execute("""
+        CREATE INDEX idx_snapshots_keyframe ON snapshots (is_keyframe, snapshot_id)
+    """)
+    await db.execute("CREATE INDEX idx_snapshots_taken ON snapshots (taken_at)")
+    # fields - JSON: весь актив (ключевой кадр или новый актив) или
+    # изменившиеся поля; removed_fields - JSON-список удаленных полей
+    await db.execute("""
+        CREATE TABLE snapshot_assets (
+            snapshot_id INTEGER NOT NULL,
+            asset_ticker TEXT NOT NULL,
+            fields TEXT,
+            removed_fields TEXT,
+            is_deleted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (snapshot_id, asset_ticker),
+            FOREIGN KEY (snapshot_id) REFERENCES snapshots(snapshot_id)
+        ) WITHOUT ROWID
+    """)
+
+
+# Миграции по порядку: версия схемы = номер последней примененной миграции.
+# Новые миграции добавляются только в конец списка
+MIGRATIONS = [
+    _migration_1_baseline,
+    _migration_2_assets,
+    _migration_3_stat_counters,
+    _migration_4_snapshots,
+]
+
+
+async def run_migrations(db) -> int:
+    """
+    Применение недостающих миграций.
+    Каждая миграция выполняется в своей транзакции вместе с обновлением
+    user_version, поэтому прерванная миграция не оставляет схему наполовину.
+
+    Returns:
+        int - версия схемы после миграций
+    """
+    cursor = await db.execute("PRAGMA user_version")
+    version = (await cursor.fetchone())[0]
+    if version > len(MIGRATIONS):
+        raise RuntimeError(
+            f"Версия схемы БД {version} новее, чем поддерживает бот ({len(MIGRATIONS)})"
+        )
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Применение миграции БД {number}: {migration.__name__}")
+        await db.execute("BEGIN")
+        try:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        version = number
+
+    return version
@@ -0,0 +1,165 @@
+"""Отправка уведомлений из очереди в SQLite с продолжением после перезапуска."""
+
+import asyncio
+import logging
+from functools import partial
+
+from aiogram import Bot, types
+
+from coalescing import NOTIFICATION_FOOTER
+from config import OUTBOX_BATCH_SIZE, OUTBOX_RETENTION_DAYS, OUTBOX_SWEEP_INTERVAL
+from database import (
+    delete_old_notifications,
+    enqueue_notifications,
+    get_pending_notifications,
+    mark_notifications_failed,
+    mark_notifications_sent,
+)
+from delivery import (
+    PRIORITY_ANNOUNCE,
+    PRIORITY_NAMES,
+    PRIORITY_REALTIME,
+    delivery_engine,
+)
+from recipients import DeadRecipients
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета уведомлений в очереди (рассылки админа идут отдельно)
+OUTBOX_PRIORITIES = (PRIORITY_REALTIME, PRIORITY_ANNOUNCE)
+
+# Сигналы о новых уведомлениях: у каждого класса свой отправитель
+_outbox_events = {priority: asyncio.Event() for priority in OUTBOX_PRIORITIES}
+
+
+async def enqueue(messages) -> int:
+    """
+    Сохранение сообщений в очередь: одна строка на каждое сообщение.
+
+    Args:
+        messages: Сообщения из coalesce_notifications (ключи user_id, type,
+            asset_ticker, message, priority)
+
+    Returns:
+        int - количество добавленных строк
+    """
+    rows = (
+        (
+            message["user_id"],
+            message.get("type"),
+            message.get("asset_ticker"),
+            message.get("message", ""),
+            message.get("priority", PRIORITY_REALTIME),
+        )
+        for message in messages
+    )
+    return await enqueue_notifications(rows)
+
+
+def wake_outbox():
+    """Разбудить отправителей после добавления уведомлений"""
+    for event in _outbox_events.values():
+        event.set()
+
+
+async def drain_outbox(bot: Bot, priority: int) -> tuple[int, int]:
+    """
+    Отправка всех ожидающих уведомлений класса priority пачками.
+    После каждой пачки результаты сохраняются в БД.
+
+    Returns:
+        tuple - (отправлено, ошибок)
+    """
+    total_sent = 0
+    total_failed = 0
+
+    while True:
+        rows = await get_pending_notifications(priority, OUTBOX_BATCH_SIZE)
+        if not rows:
+            break
+
+        sent_ids = []
+        # Последняя ошибка по каждой строке (при повторах перезаписывается)
+        errors = {}
+
+        async def send(notification_id: int, user_id: int, message_text: str):
+            try:
+                # Добавляем текст в конец каждого уведомления
+                await bot.send_message(
+                    user_id,
+                    f"{message_text}{NOTIFICATION_FOOTER}",
+                    parse_mode="HTML",
+                    link_preview_options=types.LinkPreviewOptions(is_disabled=True),
+                )
+            except Exception as e:
+                errors[notification_id] = str(e)
+                raise
+            sent_ids.append(notification_id)
+
+        dead_recipients = DeadRecipients()
+
+        def on_result(user_id: int, error: Exception | None):
+            # Заблокировавших бота исключаем из следующих рассылок
+            dead_recipients.record(user_id, error)
+            if error is not None:
+                logger.warning(
+                    f"Не удалось отправить уведомление пользователю {user_id}: {error}"
+                )
+
+        await delivery_engine.deliver(
+            (
+                (user_id, partial(send, notification_id, user_id, message_text))
+                for notification_id, user_id, message_text in rows
+            ),
+            on_result,
+            priority,
+        )
+
+        sent = set(sent_ids)
+        failures = [
+            (notification_id, errors.get(notification_id, "unknown error"))
+            for notification_id, _, _ in rows
+            if notification_id not in sent
+        ]
+        await mark_notifications_sent(sent_ids)
+        await mark_notifications_failed(failures)
+        await dead_recipients.flush()
+        total_sent += len(sent_ids)
+        total_failed += len(failures)
+
+    return total_sent, total_failed
+
+
+async def outbox_worker(bot: Bot, priority: int):
+    """
+    Фоновый отправитель очереди уведомлений одного класса приоритета.
+    При старте досылает то, что не успели отправить до перезапуска.
+    Отдельный отправитель на класс не дает анонсу на всех пользователей
+    задержать уведомления подписчикам.
+    """
+    name = PRIORITY_NAMES[priority]
+    event = _outbox_events[priority]
+    logger.info(f"Отправитель очереди уведомлений '{name}' запущен")
+
+    while True:
+        # Сбрасываем сигнал до обработки, чтобы не потерять новые уведомления
+        event.clear()
+        try:
+            sent, failed = await drain_outbox(bot, priority)
+            if sent or failed:
+                logger.info(
+                    f"Очередь уведомлений '{name}' обработана. Отправлено: {sent}, Ошибок: {failed}"
+                )
+            deleted = await delete_old_notifications(OUTBOX_RETENTION_DAYS)
+            if deleted:
+                logger.debug(f"Удалено старых уведомлений из очереди: {deleted}")
+        except Exception as e:
+            logger.error(
+                f"Ошибка при обработке очереди уведомлений: {e}", exc_info=True
+            )
+
+        # Ждем новых уведомлений или периодической проверки
+        try:
+            await asyncio.wait_for(event.wait(), timeout=OUTBOX_SWEEP_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
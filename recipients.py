@@ -0,0 +1,57 @@
+"""Учет недоступных получателей (заблокировали бота, удалили аккаунт)."""
+
+import logging
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from database import deactivate_users
+from subscription_index import subscription_index
+from user_profiles import user_profiles
+
+logger = logging.getLogger(__name__)
+
+# Ответы BadRequest, означающие, что чата больше нет
+DEAD_CHAT_MESSAGES = ("chat not found", "user not found", "peer_id_invalid")
+
+
+def dead_recipient_reason(error: Exception | None) -> str | None:
+    """
+    Причина, по которой получатель недоступен навсегда.
+
+    Returns:
+        str | None - текст ошибки для Forbidden и "chat not found", иначе None
+    """
+    if isinstance(error, TelegramForbiddenError):
+        return error.message
+    if isinstance(error, TelegramBadRequest):
+        message = error.message.lower()
+        if any(text in message for text in DEAD_CHAT_MESSAGES):
+            return error.message
+    return None
+
+
+class DeadRecipients:
+    """Сбор недоступных получателей во время отправки и запись их пачкой"""
+
+    def __init__(self):
+        self._reasons: dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._reasons)
+
+    def record(self, user_id: int, error: Exception | None):
+        """Учесть результат отправки пользователю"""
+        reason = dead_recipient_reason(error)
+        if reason is not None:
+            self._reasons[user_id] = reason
+
+    async def flush(self):
+        """Отметить собранных пользователей неактивными в БД и в индексе"""
+        if not self._reasons:
+            return
+        reasons, self._reasons = self._reasons, {}
+        await deactivate_users(reasons)
+        subscription_index.mark_inactive(reasons)
+        # При следующем /start профиль будет записан заново с is_active = 1
+        user_profiles.forget(reasons)
+        logger.info(f"Отмечено неактивными пользователей: {len(reasons)}")
@@ -0,0 +1,193 @@
+"""История снимков активов в SQLite: ключевые кадры и дельты по изменившимся полям."""
+
+import asyncio
+import json
+import logging
+import time
+
+from config import DATA_FILE, SNAPSHOT_KEYFRAME_INTERVAL
+from database import add_snapshot, get_snapshot_chain
+from diff_engine import index_by_ticker
+
+logger = logging.getLogger(__name__)
+
+# Маркер отсутствующего поля при сравнении активов
+_MISSING = object()
+
+
+def _encode(value) -> str:
+    """Компактный JSON для хранения в БД"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _keyframe_rows(assets: dict) -> list[tuple]:
+    """Строки ключевого кадра: каждый актив целиком"""
+    return [(ticker, _encode(asset), None, 0) for ticker, asset in assets.items()]
+
+
+def _delta_rows(previous: dict, current: dict) -> list[tuple]:
+    """Строки дельты: только изменившиеся поля изменившихся активов"""
+    rows = []
+    for ticker, asset in current.items():
+        old = previous.get(ticker)
+        if old == asset:
+            continue
+        if old is None:
+            # Новый актив записывается целиком
+            rows.append((ticker, _encode(asset), None, 0))
+            continue
+        changed = {
+            key: value
+            for key, value in asset.items()
+            if old.get(key, _MISSING) != value
+        }
+        removed = [key for key in old if key not in asset]
+        rows.append(
+            (ticker, _encode(changed), _encode(removed) if removed else None, 0)
+        )
+
+    for ticker in previous.keys() - current.keys():
+        rows.append((ticker, None, None, 1))
+    return rows
+
+
+def _replay(rows) -> dict:
+    """Восстановление активов по ключевому кадру и дельтам после него"""
+    assets: dict[str, dict] = {}
+    for _snapshot_id, _is_keyframe, ticker, fields, removed_fields, is_deleted in rows:
+        if is_deleted:
+            assets.pop(ticker, None)
+            continue
+        asset = assets.setdefault(ticker, {})
+        if fields:
+            asset.update(json.loads(fields))
+        if removed_fields:
+            for key in json.loads(removed_fields):
+                asset.pop(key, None)
+    return assets
+
+
+def _read_legacy(path: str):
+    """Чтение снимка из JSON файла прежних версий (в рабочем потоке)"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class SnapshotStore:
+    """
+    Снимок, с которым сравниваются новые данные API, и история всех снимков.
+
+    Каждый снимок пишется в SQLite как дельта к предыдущему, а раз в
+    keyframe_interval дельт - полным ключевым кадром, поэтому любой момент
+    восстанавливается чтением одного кадра и не более keyframe_interval дельт.
+    Если ни одно поле не изменилось, в БД ничего не пишется. Последний
+    снимок хранится в памяти, история читается только при запуске.
+    """
+
+    def __init__(self, keyframe_interval: int, legacy_path: str = None):
+        self._keyframe_interval = keyframe_interval
+        self._legacy_path = legacy_path
+        self._assets: dict[str, dict] | None = None
+        self._data: list | None = None
+        self._deltas_since_keyframe = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> list | None:
+        """Последний сохраненный снимок (None, если его еще нет)"""
+        if self._loaded:
+            return self._data
+
+        async with self._lock:
+            if self._loaded:
+                return self._data
+
+            chain = await get_snapshot_chain()
+            if chain is not None:
+                self._assets = _replay(chain["rows"])
+                self._data = list(self._assets.values())
+                self._deltas_since_keyframe = chain["deltas"]
+                logger.info(
+                    f"Снимок активов восстановлен из истории: {len(self._data)} активов, "
+                    f"дельт после ключевого кадра: {chain['deltas']}"
+                )
+            else:
+                await self._import_legacy()
+            self._loaded = True
+            return self._data
+
+    async def _import_legacy(self):
+        """Перенос снимка из DATA_FILE в историю при первом запуске"""
+        if not self._legacy_path:
+            return
+        try:
+            data = await asyncio.to_thread(_read_legacy, self._legacy_path)
+        except FileNotFoundError:
+            logger.debug(
+                f"Файл {self._legacy_path} не найден. Это нормально при первом запуске."
+            )
+            return
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            logger.error(f"Ошибка при чтении JSON файла: {e}", exc_info=True)
+            return
+
+        if not isinstance(data, list):
+            logger.error(
+                f"В файле {self._legacy_path} данные не являются списком, а {type(data)}"
+            )
+            return
+        await self._record(data)
+        logger.info(
+            f"Снимок активов перенесен из {self._legacy_path} в историю. Активов: {len(data)}"
+        )
+
+    async def save(self, data: list):
+        """
+        Сохранение нового снимка.
+        В памяти он заменяется только после успешной записи в БД.
+        """
+        async with self._lock:
+            try:
+                await self._record(data)
+            except Exception as e:
+                logger.error(
+                    f"Ошибка при сохранении снимка активов: {e}", exc_info=True
+                )
+                return
+            self._loaded = True
+
+    async def _record(self, data: list):
+        """Запись снимка ключевым кадром или дельтой"""
+        current = index_by_ticker(data)
+        keyframe = (
+            self._assets is None
+            or self._deltas_since_keyframe >= self._keyframe_interval
+        )
+        if keyframe:
+            rows = _keyframe_rows(current)
+        else:
+            rows = _delta_rows(self._assets, current)
+
+        if rows or keyframe:
+            snapshot_id = await add_snapshot(time.time(), keyframe, rows)
+            self._deltas_since_keyframe = (
+                0 if keyframe else self._deltas_since_keyframe + 1
+            )
+            logger.debug(
+                f"Снимок активов {snapshot_id} сохранен "
+                f"({'ключевой кадр' if keyframe else 'дельта'}, активов: {len(rows)})"
+            )
+
+        self._assets = current
+        self._data = data
+
+    async def snapshot_at(self, timestamp: float) -> list | None:
+        """Активы на момент времени timestamp (None, если снимков раньше нет)"""
+        chain = await get_snapshot_chain(taken_before=timestamp)
+        if chain is None:
+            return None
+        return list(_replay(chain["rows"]).values())
+
+
+# Снимок, с которым сравниваются новые данные API
+snapshot_store = SnapshotStore(SNAPSHOT_KEYFRAME_INTERVAL, legacy_path=DATA_FILE)
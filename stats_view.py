@@ -0,0 +1,140 @@
+"""Готовые страницы /get_stats: рендер один раз на снимок и постраничный вывод."""
+
+import logging
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from coalescing import TELEGRAM_MESSAGE_LIMIT, text_length
+from forecast import forecaster
+
+logger = logging.getLogger(__name__)
+
+# Префикс callback_data кнопок листания
+PAGE_CALLBACK_PREFIX = "stats_page_"
+# Заголовок страницы (номер страницы добавляется, если их несколько)
+STATS_TITLE = "📊 <b>Assets Statistics</b>"
+# Запас под номер страницы в заголовке
+PAGE_LABEL_RESERVE = 16
+
+
+def _fill_info(asset: dict) -> str:
+    """Строка "заполнено / лимит (процент)" актива"""
+    lst_tvl = asset.get("lst_tvl")
+    lst_cap = asset.get("lst_cap")
+    if lst_tvl is None or lst_cap is None:
+        return "N/A"
+    try:
+        tvl_int = int(float(lst_tvl))
+        cap_int = int(float(lst_cap))
+    except (ValueError, TypeError):
+        return "N/A"
+
+    # Вычисляем процент заполнения
+    if cap_int > 0:
+        percentage_str = f"{(tvl_int / cap_int) * 100:.2f}%"
+    else:
+        percentage_str = "N/A"
+    return f"{tvl_int:,} / {cap_int:,} ({percentage_str})"
+
+
+def _render_asset(asset: dict) -> str:
+    """Блок одного актива"""
+    ticker = asset.get("asset_ticker", "N/A")
+    lines = [
+        f"<b>{asset.get('asset_name', 'Unknown')}</b> ({ticker})",
+        f"Epoch: {asset.get('epoch', 'N/A')}",
+        f"Filled: {_fill_info(asset)}",
+    ]
+    eta_note = forecaster.fill_note(ticker)
+    if eta_note:
+        lines.append(eta_note.strip())
+    return "\n".join(lines)
+
+
+def render_pages(assets: list) -> list[str]:
+    """Страницы статистики по активам с эпохой, каждая не длиннее лимита Telegram"""
+    blocks = [_render_asset(asset) for asset in assets if "epoch" in asset]
+    budget = TELEGRAM_MESSAGE_LIMIT - text_length(STATS_TITLE) - PAGE_LABEL_RESERVE
+
+    bodies = []
+    current = ""
+    for block in blocks:
+        candidate = f"{current}\n\n{block}" if current else block
+        if current and text_length(candidate) > budget:
+            bodies.append(current)
+            current = block
+        else:
+            current = candidate
+    if current:
+        bodies.append(current)
+
+    if len(bodies) == 1:
+        return [f"{STATS_TITLE}\n\n{bodies[0]}"]
+    return [
+        f"{STATS_TITLE} ({number}/{len(bodies)})\n\n{body}"
+        for number, body in enumerate(bodies, start=1)
+    ]
+
+
+def _page_keyboard(page: int, total: int) -> InlineKeyboardMarkup | None:
+    """Кнопки листания (нет, если страница одна)"""
+    if total <= 1:
+        return None
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(
+            text="◀️", callback_data=f"{PAGE_CALLBACK_PREFIX}{(page - 1) % total}"
+        ),
+        InlineKeyboardButton(
+            text=f"{page + 1}/{total}", callback_data=f"{PAGE_CALLBACK_PREFIX}{page}"
+        ),
+        InlineKeyboardButton(
+            text="▶️", callback_data=f"{PAGE_CALLBACK_PREFIX}{(page + 1) % total}"
+        ),
+    )
+    return builder.as_markup()
+
+
+class StatsView:
+    """
+    Кэш отрендеренных страниц /get_stats.
+
+    Страницы пересобираются только при смене ключа (версия снимка активов и
+    ревизия прогноза), остальные вызовы отдают готовый текст и клавиатуру.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._pages: list[tuple[str, InlineKeyboardMarkup | None]] = []
+        self.renders = 0
+
+    def page(self, assets: list, key, number: int = 0) -> tuple | None:
+        """
+        Страница статистики.
+
+        Args:
+            assets: Текущий снимок активов
+            key: Ключ кэша; при его смене страницы рендерятся заново
+            number: Номер страницы с нуля (приводится к допустимому)
+
+        Returns:
+            tuple - (текст, клавиатура или None); None, если активов с эпохой нет
+        """
+        if key != self._key:
+            texts = render_pages(assets)
+            self._pages = [
+                (text, _page_keyboard(index, len(texts)))
+                for index, text in enumerate(texts)
+            ]
+            self._key = key
+            self.renders += 1
+            logger.debug(f"Статистика активов отрендерена: страниц {len(texts)}")
+
+        if not self._pages:
+            return None
+        return self._pages[min(max(number, 0), len(self._pages) - 1)]
+
+
+# Общий кэш страниц статистики
+stats_view = StatsView()
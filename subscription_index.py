@@ -0,0 +1,146 @@
+"""Индекс подписок в памяти, синхронизированный с SQLite."""
+
+import logging
+
+from database import get_all_subscriptions, get_inactive_user_ids, toggle_subscription
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionIndex:
+    """
+    Двунаправленный индекс подписок: актив → пользователи и пользователь → активы.
+
+    Загружается из БД при старте и обновляется при каждом переключении
+    подписки (сначала запись в БД, затем в память). Неактивные пользователи
+    остаются в индексе, но не попадают в списки подписчиков.
+    """
+
+    def __init__(self):
+        self._by_ticker: dict[str, set[int]] = {}
+        self._by_user: dict[int, set[str]] = {}
+        self._inactive: set[int] = set()
+        self._loaded = False
+        # Счетчик изменений: сверка не должна затирать переключения и смену
+        # активности пользователей во время чтения БД
+        self._generation = 0
+
+    @property
+    def loaded(self) -> bool:
+        """Индекс загружен из БД и может использоваться вместо запросов"""
+        return self._loaded
+
+    async def load(self):
+        """Полная загрузка индекса из БД"""
+        by_ticker, by_user = self._build(await get_all_subscriptions())
+        self._by_ticker = by_ticker
+        self._by_user = by_user
+        self._inactive = await get_inactive_user_ids()
+        self._loaded = True
+        logger.info(
+            f"Индекс подписок загружен: пользователей {len(by_user)}, активов {len(by_ticker)}"
+        )
+
+    async def toggle(
+        self, user_id: int, asset_ticker: str, asset_name: str = None
+    ) -> bool:
+        """
+        Переключение подписки с записью в БД и обновлением индекса.
+
+        Returns:
+            bool - True, если подписка добавлена, False если отменена
+        """
+        is_subscribed = await toggle_subscription(user_id, asset_ticker, asset_name)
+        self._generation += 1
+        if is_subscribed:
+            self._by_ticker.setdefault(asset_ticker, set()).add(user_id)
+            self._by_user.setdefault(user_id, set()).add(asset_ticker)
+        else:
+            self._discard(self._by_ticker, asset_ticker, user_id)
+            self._discard(self._by_user, user_id, asset_ticker)
+        return is_subscribed
+
+    def user_tickers(self, user_id: int) -> set[str]:
+        """Активы, на которые подписан пользователь"""
+        return set(self._by_user.get(user_id, ()))
+
+    def subscribers_by_tickers(self, asset_tickers) -> dict[str, list[int]]:
+        """Активные подписчики для набора активов в формате get_subscribers_by_tickers"""
+        subscribers = {}
+        for ticker in dict.fromkeys(asset_tickers):
+            users = self._by_ticker.get(ticker, set()) - self._inactive
+            if users:
+                subscribers[ticker] = list(users)
+        return subscribers
+
+    def is_inactive(self, user_id: int) -> bool:
+        """Пользователь исключен из рассылок"""
+        return user_id in self._inactive
+
+    def mark_inactive(self, user_ids):
+        """Исключить пользователей из рассылок (после записи в БД)"""
+        self._generation += 1
+        self._inactive.update(user_ids)
+
+    def mark_active(self, user_id: int):
+        """Вернуть пользователя в рассылки (после записи в БД)"""
+        self._generation += 1
+        self._inactive.discard(user_id)
+
+    async def verify(self, repair: bool = True) -> bool:
+        """
+        Сверка индекса с БД.
+
+        Args:
+            repair: Заменить индекс данными из БД при расхождении
+
+        Returns:
+            bool - True, если индекс совпадает с БД
+        """
+        generation = self._generation
+        inactive = await get_inactive_user_ids()
+        by_ticker, by_user = self._build(await get_all_subscriptions())
+        if generation != self._generation:
+            logger.debug("Подписки менялись во время сверки, пропускаем")
+            return True
+        self._inactive = inactive
+        if by_ticker == self._by_ticker and by_user == self._by_user:
+            logger.debug("Индекс подписок совпадает с БД")
+            return True
+
+        db_pairs = {(u, t) for t, users in by_ticker.items() for u in users}
+        index_pairs = {
+            (u, t) for t, users in self._by_ticker.items() for u in users
+        } | {(u, t) for u, tickers in self._by_user.items() for t in tickers}
+        logger.warning(
+            f"Индекс подписок расходится с БД: нет в индексе {len(db_pairs - index_pairs)}, "
+            f"лишних в индексе {len(index_pairs - db_pairs)}"
+        )
+        if repair:
+            self._by_ticker = by_ticker
+            self._by_user = by_user
+            logger.info("Индекс подписок перестроен из БД")
+        return False
+
+    @staticmethod
+    def _build(pairs) -> tuple[dict, dict]:
+        """Построение обоих направлений индекса из пар (user_id, asset_ticker)"""
+        by_ticker: dict[str, set[int]] = {}
+        by_user: dict[int, set[str]] = {}
+        for user_id, asset_ticker in pairs:
+            by_ticker.setdefault(asset_ticker, set()).add(user_id)
+            by_user.setdefault(user_id, set()).add(asset_ticker)
+        return by_ticker, by_user
+
+    @staticmethod
+    def _discard(index: dict, key, value):
+        """Удаление значения с очисткой пустых множеств"""
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
+
+
+# Общий индекс подписок процесса
+subscription_index = SubscriptionIndex()
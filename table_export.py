@@ -0,0 +1,117 @@
+"""Потоковый экспорт таблиц в CSV, сжатый gzip и разбитый на части под лимит загрузки Telegram."""
+
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import os
+
+from config import EXPORT_CHUNK_SIZE, EXPORT_PART_SIZE
+from database import iter_table_rows
+
+logger = logging.getLogger(__name__)
+
+# Уровень сжатия: заметно быстрее максимального при почти том же размере
+GZIP_COMPRESSION_LEVEL = 6
+
+
+class GzipCsvParts:
+    """
+    Запись CSV в файлы .csv.gz с переходом на новую часть,
+    когда сжатый размер текущей достигает part_size байт.
+    Каждая часть - самостоятельный CSV с заголовком.
+    Методы выполняют блокирующий ввод-вывод и вызываются в рабочем потоке.
+    """
+
+    def __init__(self, directory: str, name: str, header: list, part_size: int):
+        self._directory = directory
+        self._name = name
+        self._header = header
+        self._part_size = part_size
+        self._raw = None
+        self._text = None
+        self._writer = None
+        self.paths: list[str] = []
+        self.rows = 0
+
+    def _open_part(self):
+        """Начало новой части с заголовком"""
+        path = os.path.join(
+            self._directory, f"{self._name}.part{len(self.paths) + 1}.csv.gz"
+        )
+        self._raw = open(path, "wb")
+        gz = gzip.GzipFile(
+            filename=f"{self._name}.csv",
+            mode="wb",
+            fileobj=self._raw,
+            compresslevel=GZIP_COMPRESSION_LEVEL,
+        )
+        self._text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(self._header)
+        self.paths.append(path)
+
+    def _close_part(self):
+        """Завершение текущей части (дописывает хвост gzip)"""
+        if self._text is None:
+            return
+        # GzipFile не закрывает переданный ему файл, поэтому закрываем оба
+        self._text.close()
+        self._raw.close()
+        self._text = None
+        self._raw = None
+
+    def write_rows(self, rows):
+        """Запись строк; размер части проверяется по уже сжатым байтам на диске"""
+        if self._text is None:
+            self._open_part()
+        for row in rows:
+            self._writer.writerow(row)
+            self.rows += 1
+            # Часть данных еще в буферах zlib, поэтому part_size берется с запасом
+            if self._raw.tell() >= self._part_size:
+                self._close_part()
+                self._open_part()
+
+    def close(self):
+        """Завершение экспорта (пустая таблица дает одну часть с заголовком)"""
+        if not self.paths:
+            self._open_part()
+        self._close_part()
+
+
+async def export_table(table_name: str, directory: str) -> list[tuple[str, str]]:
+    """
+    Экспорт таблицы в сжатый CSV, разбитый на части.
+    Чтение идет пачками по EXPORT_CHUNK_SIZE строк, сжатие и запись -
+    в рабочем потоке, чтобы не блокировать event loop.
+
+    Returns:
+        list - пары (путь к файлу, имя файла для отправки)
+    """
+    rows_iter = iter_table_rows(table_name, EXPORT_CHUNK_SIZE)
+    parts = None
+    try:
+        async for chunk in rows_iter:
+            if parts is None:
+                # Первая выдача - названия колонок
+                parts = GzipCsvParts(directory, table_name, chunk, EXPORT_PART_SIZE)
+                continue
+            await asyncio.to_thread(parts.write_rows, chunk)
+    finally:
+        await rows_iter.aclose()
+        if parts is not None:
+            await asyncio.to_thread(parts.close)
+
+    if len(parts.paths) == 1:
+        files = [(parts.paths[0], f"{table_name}.csv.gz")]
+    else:
+        files = [
+            (path, f"{table_name}.part{number}.csv.gz")
+            for number, path in enumerate(parts.paths, start=1)
+        ]
+    logger.info(
+        f"Таблица {table_name} экспортирована. Записей: {parts.rows}, файлов: {len(files)}"
+    )
+    return files
@@ -0,0 +1,164 @@
+"""Скользящие ряды TVL и лимита активов в памяти с агрегацией по минутам, часам и дням."""
+
+import logging
+from collections import deque
+
+from diff_engine import AssetState, index_by_ticker
+
+logger = logging.getLogger(__name__)
+
+# Разрешения рядов: (название, длина интервала в секундах, сколько интервалов хранить)
+RESOLUTIONS = (
+    ("1m", 60, 180),  # 3 часа
+    ("1h", 60 * 60, 168),  # 7 дней
+    ("1d", 24 * 60 * 60, 90),  # 90 дней
+)
+
+# Заголовки разрешений в /history
+RESOLUTION_TITLES = {"1m": "Per minute", "1h": "Per hour", "1d": "Per day"}
+
+# Символы мини-графика от минимума к максимуму
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class Bucket:
+    """Агрегат значений TVL за один интервал"""
+
+    __slots__ = ("start", "samples", "first", "last", "low", "high", "cap")
+
+    def __init__(self, start: int, tvl: float, cap: float | None):
+        self.start = start
+        self.samples = 1
+        self.first = tvl
+        self.last = tvl
+        self.low = tvl
+        self.high = tvl
+        self.cap = cap
+
+    def add(self, tvl: float, cap: float | None):
+        """Добавление значения в текущий интервал"""
+        self.samples += 1
+        self.last = tvl
+        if tvl < self.low:
+            self.low = tvl
+        if tvl > self.high:
+            self.high = tvl
+        if cap is not None:
+            self.cap = cap
+
+
+class AssetSeries:
+    """Кольцевые буферы интервалов одного актива для всех разрешений"""
+
+    __slots__ = ("ticker", "name", "buffers")
+
+    def __init__(self, ticker: str, name: str):
+        self.ticker = ticker
+        self.name = name
+        self.buffers = {label: deque(maxlen=points) for label, _, points in RESOLUTIONS}
+
+    def add(self, timestamp: float, tvl: float, cap: float | None):
+        """Учет одного значения: O(1) на каждое разрешение"""
+        for label, seconds, _ in RESOLUTIONS:
+            buffer = self.buffers[label]
+            start = int(timestamp // seconds) * seconds
+            if buffer and buffer[-1].start == start:
+                buffer[-1].add(tvl, cap)
+            elif not buffer or buffer[-1].start < start:
+                # Старейший интервал вытесняется при заполнении буфера
+                buffer.append(Bucket(start, tvl, cap))
+            # Значения "из прошлого" (часы сдвинулись назад) пропускаются
+
+
+class TimeSeriesEngine:
+    """
+    Ряды TVL и лимита по всем активам, которые наполняет цикл опроса API.
+
+    Память ограничена: на каждый актив хранится фиксированное число
+    интервалов каждого разрешения, старые вытесняются новыми.
+    """
+
+    def __init__(self):
+        self._series: dict[str, AssetSeries] = {}
+        self.samples = 0
+
+    def add_snapshot(self, assets: list, timestamp: float):
+        """Добавление значений всех активов из снимка API"""
+        for ticker, asset in index_by_ticker(assets).items():
+            state = AssetState(ticker, asset)
+            if state.tvl is None:
+                continue
+            series = self._series.get(ticker)
+            if series is None:
+                series = self._series[ticker] = AssetSeries(ticker, state.name)
+            series.name = state.name
+            series.add(timestamp, state.tvl, state.cap)
+            self.samples += 1
+
+    def get(self, ticker: str) -> AssetSeries | None:
+        """Ряды актива по тикеру (без учета регистра)"""
+        series = self._series.get(ticker)
+        if series is not None:
+            return series
+        ticker = ticker.lower()
+        for known, series in self._series.items():
+            if known.lower() == ticker:
+                return series
+        return None
+
+
+def _sparkline(values: list[float]) -> str:
+    """Мини-график из символов блоков"""
+    low = min(values)
+    high = max(values)
+    if high == low:
+        return SPARK_CHARS[0] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(SPARK_CHARS[int((value - low) * scale)] for value in values)
+
+
+def _format_signed(value: float) -> str:
+    """Целое число со знаком и разделителями тысяч"""
+    return f"{value:+,.0f}"
+
+
+def render_history(series: AssetSeries, points: int = 24) -> str:
+    """
+    Текст /history по готовым интервалам: последние points интервалов
+    каждого разрешения, без обхода исходных значений.
+    """
+    lines = [f"📈 <b>{series.name}</b> ({series.ticker})"]
+
+    latest = None
+    for label, _, _ in RESOLUTIONS:
+        if series.buffers[label]:
+            latest = series.buffers[label][-1]
+            break
+    if latest is not None:
+        if latest.cap:
+            percentage = latest.last / latest.cap * 100
+            lines.append(
+                f"Filled: {latest.last:,.0f} / {latest.cap:,.0f} ({percentage:.2f}%)"
+            )
+        else:
+            lines.append(f"Capacity: {latest.last:,.0f}")
+
+    for label, _, _ in RESOLUTIONS:
+        buffer = series.buffers[label]
+        if not buffer:
+            continue
+        window = list(buffer)[-points:]
+        change = window[-1].last - window[0].first
+        low = min(bucket.low for bucket in window)
+        high = max(bucket.high for bucket in window)
+        lines.append("")
+        lines.append(f"<b>{RESOLUTION_TITLES[label]}</b> (last {len(window)})")
+        lines.append(f"<code>{_sparkline([bucket.last for bucket in window])}</code>")
+        lines.append(f"Change: {_format_signed(change)}")
+        lines.append(f"Range: {low:,.0f} – {high:,.0f}")
+
+    return "\n".join(lines)
+
+
+# Общие ряды процесса
+timeseries = TimeSeriesEngine()
@@ -0,0 +1,154 @@
+"""Кэш профилей пользователей с отложенной пакетной записью в SQLite."""
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+from config import USER_CACHE_FLUSH_BATCH, USER_CACHE_SIZE
+from database import get_user_profile, save_users
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfileCache:
+    """
+    Профили активных пользователей в памяти (username, first_name, last_name).
+
+    Запись в кэше означает, что в БД уже лежит такой же профиль активного
+    пользователя, поэтому повторный /start без изменений ничего не пишет.
+    Изменения копятся и сохраняются пачкой раз в USER_CACHE_FLUSH_INTERVAL
+    секунд (или раньше, если накопилось USER_CACHE_FLUSH_BATCH).
+    """
+
+    def __init__(self, max_size: int, flush_batch: int):
+        self._max_size = max_size
+        self._flush_batch = flush_batch
+        # Сохраненные профили, вытесняются по давности использования
+        self._profiles: OrderedDict[int, tuple] = OrderedDict()
+        # Профили, ожидающие записи в БД
+        self._dirty: dict[int, tuple] = {}
+        self._flush_event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # Статистика: сколько сохранений обошлось без записи
+        self.hits = 0
+        self.writes = 0
+
+    @property
+    def pending(self) -> int:
+        """Количество профилей, ожидающих записи"""
+        return len(self._dirty)
+
+    async def save(
+        self,
+        user_id: int,
+        username: str = None,
+        first_name: str = None,
+        last_name: str = None,
+        write_through: bool = False,
+    ):
+        """
+        Сохранение профиля: запись в БД откладывается, если он изменился.
+        write_through - записать сразу (например, возвращение неактивного
+        пользователя, которое должно попасть в БД до возврата в рассылки).
+        """
+        profile = (username, first_name, last_name)
+
+        if write_through:
+            try:
+                await save_users([(user_id, *profile)])
+            except Exception as e:
+                # Не записалось сразу - запишется со следующей пачкой
+                logger.error(
+                    f"Ошибка при сохранении профиля пользователя {user_id}: {e}",
+                    exc_info=True,
+                )
+                self._dirty[user_id] = profile
+                self._flush_event.set()
+                return
+            self._dirty.pop(user_id, None)
+            self._remember(user_id, profile)
+            self.writes += 1
+            return
+
+        if user_id in self._dirty:
+            self._dirty[user_id] = profile
+            return
+
+        cached = self._profiles.get(user_id)
+        if cached is None:
+            # Нет в памяти: сверяемся с БД одним чтением вместо записи
+            cached = await get_user_profile(user_id)
+            if cached is not None:
+                self._remember(user_id, cached)
+
+        if cached == profile:
+            self._profiles.move_to_end(user_id)
+            self.hits += 1
+            return
+
+        self._dirty[user_id] = profile
+        if len(self._dirty) >= self._flush_batch:
+            self._flush_event.set()
+
+    def forget(self, user_ids):
+        """Сброс пользователей из кэша (например, после отметки неактивными)"""
+        for user_id in user_ids:
+            self._profiles.pop(user_id, None)
+            self._dirty.pop(user_id, None)
+
+    async def flush(self) -> int:
+        """
+        Запись накопленных изменений в БД одной транзакцией.
+        При ошибке изменения остаются в очереди до следующей попытки.
+
+        Returns:
+            int - количество сохраненных профилей
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            batch, self._dirty = self._dirty, {}
+            try:
+                await save_users(
+                    (user_id, *profile) for user_id, profile in batch.items()
+                )
+            except Exception:
+                # Более новые изменения, пришедшие во время записи, не затираем
+                for user_id, profile in batch.items():
+                    self._dirty.setdefault(user_id, profile)
+                raise
+
+            for user_id, profile in batch.items():
+                if user_id not in self._dirty:
+                    self._remember(user_id, profile)
+            self.writes += len(batch)
+            return len(batch)
+
+    async def run(self, interval: float):
+        """Фоновая запись изменений раз в interval секунд"""
+        logger.info("Отложенная запись профилей пользователей запущена")
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                saved = await self.flush()
+                if saved:
+                    logger.debug(f"Сохранено профилей пользователей: {saved}")
+            except Exception as e:
+                logger.error(
+                    f"Ошибка при сохранении профилей пользователей: {e}", exc_info=True
+                )
+
+    def _remember(self, user_id: int, profile: tuple):
+        """Добавление профиля в кэш с вытеснением самых старых"""
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self._max_size:
+            self._profiles.popitem(last=False)
+
+
+# Общий кэш профилей процесса
+user_profiles = UserProfileCache(USER_CACHE_SIZE, USER_CACHE_FLUSH_BATCH)